@@ -7,7 +7,7 @@ import geopandas as gpd
 gdf = gpd.GeoDataFrame
 sjoin = gpd.tools.sjoin
 
-from get import get_quadFrm, get_intersection_weights
+from get import get_quadFrm, get_intersection_weights, get_population_weights
 from utils import quadkeys_to_poly
 
 STATES = {
@@ -21,10 +21,26 @@ STATES = {
     'wa': 'Western Australia'
     }
 
-def aggregate_mob_tiles_to_abs(frm, clip = None, aggType = 'lga', **kwargs):
+def aggregate_mob_tiles_to_abs(
+        frm,
+        clip = None,
+        aggType = 'lga',
+        weightType = 'area',
+        absFrm = None,
+        **kwargs
+        ):
     import load
-    absFrm = load.load_generic(aggType)
-    out = aggregate_mob_tiles_to_regions(frm, absFrm, **kwargs)
+    if absFrm is None:
+        absFrm = load.load_generic(aggType)
+        if kwargs.get('weights') is None and kwargs.get('sindex') is None:
+            import spindex
+            kwargs['sindex'] = spindex.get_generic_index(aggType)
+            kwargs['name'] = spindex.generic_name(aggType)
+    if weightType == 'pop' and kwargs.get('weights') is None \
+            and not 'popWeights' in kwargs:
+        zoom = len(frm.index.get_level_values('quadkey')[0])
+        kwargs['popWeights'] = get_population_weights(absFrm, zoom, name = aggType)
+    out = aggregate_mob_tiles_to_regions(frm, absFrm, weightType = weightType, **kwargs)
     if not clip is None:
         if clip in STATES:
             indexNames = out.index.names
@@ -38,8 +54,16 @@ def aggregate_mob_tiles_to_regions(
         fromFrm,
         toFrm,
         weights = None,
+        weightType = 'area',
+        popWeights = None,
+        bounds = None,
+        sindex = None,
+        name = None,
         ):
 
+    # sindex may index toFrm or any boundary set it was trimmed from;
+    # name, if given, names the boundary set for the cached tile weights.
+
     print("Aggregating from tiles to regions...")
 
     # Trim frame
@@ -47,11 +71,11 @@ def aggregate_mob_tiles_to_regions(
     indexNames = frm.index.names
     frm = frm.reset_index()
     quadkeys = [*frm['quadkey'], *frm['end_key']]
-    bounds = quadkeys_to_poly(quadkeys).envelope
+    if bounds is None:
+        bounds = get_tile_bounds(quadkeys)
     toFrm = toFrm.loc[toFrm.intersects(bounds)]
     if weights is None:
-        quadFrm = get_quadFrm(quadkeys)
-        weights = get_intersection_weights(quadFrm, toFrm)
+        weights = get_tile_weights(quadkeys, toFrm, weightType, popWeights, sindex, name)
     frm = frm.reset_index().set_index('quadkey')
     frm = frm.drop(
         set(frm.index).difference(set(weights.keys()))
@@ -120,6 +144,26 @@ def aggregate_mob_tiles_to_regions(
 
     return frm
 
+def get_tile_bounds(quadkeys):
+    return quadkeys_to_poly(quadkeys).envelope
+
+def get_tile_weights(quadkeys, toFrm, weightType = 'area', popWeights = None, sindex = None, name = None):
+    quadFrm = get_quadFrm(quadkeys)
+    if not name is None:
+        name = '_'.join([name, str(len(quadkeys[0]))])
+    weights = get_intersection_weights(quadFrm, toFrm, name = name, sindex = sindex)
+    if weightType == 'pop':
+        # Tiles with no resident population keep their area weights:
+        if popWeights is None:
+            popWeights = get_population_weights(toFrm, len(quadkeys[0]))
+        weights = {
+            key: popWeights[key] if key in popWeights else val
+                for key, val in weights.items()
+            }
+    elif not weightType == 'area':
+        raise ValueError(weightType)
+    return weights
+
 def make_date(d):
     return '-'.join([str(x).zfill(2) for x in d.timetuple()[:3]])
 def aggregate_by_date(
@@ -137,10 +181,13 @@ def aggregate_by_date(
     print("Aggregated.")
     return frm
 
-def match_regions_by_majority_area(fromFrm, toFrm):
+def match_regions_by_majority_area(fromFrm, toFrm, sindex = None):
     fromIndices = fromFrm.index.names
     print("Performing spatial join...")
-    joined = sjoin(fromFrm, toFrm, 'left', 'intersects')
+    if sindex is None:
+        import spindex
+        sindex = spindex.get_spatial_index(toFrm)
+    joined = sindex.query_join(fromFrm, toFrm, 'intersects', how = 'left')
     groupby = joined.reset_index().groupby(fromIndices)
     groupby = groupby[['index_right', 'geometry']]
     def group_func(x):
@@ -176,10 +223,6 @@ def match_regions_by_majority_area(fromFrm, toFrm):
 #     return outFrm
 
 def aggregate_identicals(frm, **kwargs):
-    frm = frm.sort_index()
-    groupby = frm.groupby([
-        frm.index.get_level_values(name)
-            for name in frm.index.names
-        ])
+    groupby = frm.groupby(level = list(range(frm.index.nlevels)))
     frm = groupby.aggregate(kwargs)
     return frm
\ No newline at end of file
@@ -5,10 +5,9 @@ import re
 import numpy as np
 import pandas as pd
 from scipy.special import expit
-import itertools
-import datetime
 
 import load
+import casedata
 
 dirPath = os.path.abspath(os.path.dirname(__file__))
 dataDir = os.path.join(dirPath, 'products')
@@ -86,7 +85,7 @@ def make_casesFrm_monash(region = 'vic'):
 
     # From Monash
     # Load data:
-    cases = pd.read_csv('https://homepages.inf.ed.ac.uk/ngoddard/covid19/vicdata/lgadata.csv')
+    cases = casedata.get_table('monash')
     pop = dict(cases.loc[cases['Date'] == 'Population'].iloc[0].drop('Date'))
     cases = cases.drop([0, 1, 2])
     cases['Date'] = cases['Date'].astype('datetime64[ns]')
@@ -114,18 +113,11 @@ def make_casesFrm_monash(region = 'vic'):
     cases['cumulative'] = cases['cumulative'] / cases['pop'] * 10000
 
     # Add averages:
-    serieses = dict()
-    weightKey = 'pop'
-    level = 'date'
-    for key in [key for key in cases if not key == weightKey]:
-        fn = lambda f: np.average(f[key], weights = f[weightKey])
-        series = cases[[key, weightKey]].groupby(level = level).apply(fn)
-        serieses[key] = series
-    avFrm = pd.DataFrame(serieses)
+    avFrm = calculate_averages(cases)
     avFrm['name'] = 'average'
     avFrm = avFrm.reset_index().set_index(['date', 'name'])
-    cases = cases.drop(weightKey, axis = 1)
-    cases = cases.append(avFrm)
+    cases = cases.drop('pop', axis = 1)
+    cases = pd.concat([cases, avFrm])
     cases = cases.dropna().sort_index()
 
     # Return:
@@ -147,7 +139,7 @@ def make_casesFrm_covidlive(region = 'vic'):
         CASE_CNT = 'cumulative'
         )
 
-    cases = pd.read_json("https://covidlive.com.au/covid-live-loc.json")
+    cases = casedata.get_table('covidlive')
     cases = cases.rename(mapper = renameDict, axis = 1)
     cases = cases[sorted(renameDict.values())]
     cases['date'] = cases['date'].astype('datetime64[ns]')
@@ -164,18 +156,11 @@ def make_casesFrm_covidlive(region = 'vic'):
     cases['cumulative'] = cases['cumulative'] / cases['pop'] * 10000
 
     # Add averages:
-    serieses = dict()
-    weightKey = 'pop'
-    level = 'date'
-    for key in [key for key in cases if not key == weightKey]:
-        fn = lambda f: np.average(f[key], weights = f[weightKey])
-        series = cases[[key, weightKey]].groupby(level = level).apply(fn)
-        serieses[key] = series
-    avFrm = pd.DataFrame(serieses)
+    avFrm = calculate_averages(cases)
     avFrm['name'] = 'average'
     avFrm = avFrm.reset_index().set_index(['date', 'name'])
-    cases = cases.drop(weightKey, axis = 1)
-    cases = cases.append(avFrm)
+    cases = cases.drop('pop', axis = 1)
+    cases = pd.concat([cases, avFrm])
     cases = cases.dropna().sort_index()
 
     # Return:
@@ -184,8 +169,7 @@ def make_casesFrm_covidlive(region = 'vic'):
 def get_gov_covid_data(agg = 'lga', region = 'vic'):
     aggchoices = dict(lga = 'name', postcode = 'postcode')
     agg = aggchoices[agg]
-    url = 'https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv'
-    cases = pd.read_csv(url)
+    cases = casedata.get_table('gov')
     cases['diagnosis_date'] = cases['diagnosis_date'].astype('datetime64[ns]')
     cases = cases.rename(dict(
         diagnosis_date = 'date',
@@ -207,78 +191,203 @@ def get_gov_covid_data(agg = 'lga', region = 'vic'):
     cases = cases.groupby(['date', agg])[['new', 'mystery']].sum()
     return cases
 
-def make_casesFrm_gov(region = 'vic', agg = 'lga'):
+def make_casesFrm_gov(region = 'vic', agg = 'lga', keepState = True):
 
     cases = get_gov_covid_data()
 
-    names = list(set(cases.index.get_level_values('name')))
-    base = datetime.datetime(2020, 1, 1)
-    days = []
-    day = base
-    maxday = cases.index.get_level_values('date').max() + datetime.timedelta(days = 30)
-    while day < maxday:
-        days.append(day)
-        day += datetime.timedelta(days = 1)
-    blank = pd.DataFrame(
-        itertools.product(days, names, [0], [0]),
-        columns = ('date', 'name', 'new', 'mystery')
-        )
-    blank = blank.set_index(['date', 'name'])
-
-    blank[cases.columns] = cases
-    cases = blank
-    cases = cases.fillna(0)
-
+    # Population by council (the last entry for any repeated name):
     lookup = make_sub_lookupFrm(region, 'lga')
-    popDict = dict(zip(lookup.index, lookup['pop']))
-    cases = cases.loc[(slice(None), popDict.keys()),]
-    cases['pop'] = [popDict[n] for n in cases.index.get_level_values('name')]
-    cases['new'] = cases['new'] / cases['pop'] * 10000
-    cases['new_rolling'] = cases['new'].groupby(level = 'name', group_keys = False) \
-        .rolling(7).mean().sort_index()
-    cases['new_rolling'] = cases['new_rolling'].apply(lambda s: 0 if s < 1e-3 else s)
-    cases['cumulative'] = cases.groupby('name')['new'].cumsum()
+    pop = lookup['pop'].groupby(level = 'name').last()
+    names = sorted(set(cases.index.get_level_values('name')).intersection(pop.index))
+
+    # Dense date x council grid from the start of 2020
+    # until 30 days past the last case:
+    base = pd.Timestamp(2020, 1, 1)
+    maxday = cases.index.get_level_values('date').max() + pd.Timedelta(days = 30)
+    days = pd.date_range(base, periods = int(np.ceil((maxday - base) / pd.Timedelta(days = 1))))
+    grid = pd.MultiIndex.from_product([days, names], names = ['date', 'name'])
+    cases = cases.reindex(grid, fill_value = 0)
+    shape = (len(days), len(names))
+
+    new = cases['new'].to_numpy(dtype = float).reshape(shape)
+    new = new / pop.reindex(names).to_numpy(dtype = float) * 10000
+    mystery = cases['mystery'].to_numpy(dtype = float).reshape(shape)
+
+    # Rolling week means and running totals from cumulative sums down each column,
+    # only computed for the days that are new or have changed since the last build:
+    import incremental
+    if keepState:
+        stateName = '_'.join(['gov', region, agg])
+        state = incremental.load_state(stateName, incremental.RollingState(window = 7))
+        cumulative, rolling = state.update(days, names, new)
+        incremental.save_state(stateName, state)
+    else:
+        cumulative, rolling = incremental.rolling_totals(new, window = 7)
+    rolling = np.where(rolling < 1e-3, 0., rolling)
+
+    cases = pd.DataFrame(
+        dict(
+            new = new.ravel(),
+            mystery = mystery.ravel(),
+            new_rolling = rolling.ravel(),
+            cumulative = cumulative.ravel(),
+            ),
+        index = grid,
+        )
     cases = cases.dropna()
-    cases = cases.drop('pop', axis = 1)
 
     return cases
 
+# States with council-level case data:
+CASESTATES = {'vic'}
+
 def make_casesFrm(region = 'vic', agg = 'lga'):
-    if not region == 'vic': raise Exception
+    region = load.METROSTATES.get(region, region)
+    if not region in CASESTATES:
+        raise ValueError("No case data for region: " + region)
     return make_casesFrm_gov(region, agg)
 
 def remove_brackets(x):
     # Remove brackets from ABS council names:
     return re.sub("[\(\[].*?[\)\]]", "", x).strip()
 
-def calculate_day_scores(series, level = 'date', n = 4):
-    # Takes a series indexed by date
-    # and returns normalised values grouped by date
-    index = series.index.get_level_values(level)
-    series = pd.DataFrame(data = dict(
-        val = series.values,
-        date = index,
-        day = [int(d.strftime('%w')) for d in index.tolist()]
-        )).set_index([level, 'day'])['val']
-    groups = series.groupby(level = 'day')
-    highs = groups.apply(lambda s: s.nlargest(n).mean())
-    lows = groups.apply(lambda s: s.nsmallest(n).mean())
-    series = (series - lows) / (highs - lows)
-    series = pd.Series(series.values, index)
-    return series
-
-def calculate_averages(frm, level = 'date', weightKey = 'pop'):
-    # Get a frame that contains averages by some chosen level
-    serieses = dict()
-    level = 'date'
-    weightKey = 'pop'
-    for key in [col for col in frm.columns if not col == weightKey]:
-        fn = lambda f: np.average(f[key], weights = f[weightKey])
-        series = frm[[key, weightKey]].groupby(level = level).apply(fn)
-        serieses[key] = series
-    return pd.DataFrame(serieses)
-
-def make_dataFrm(region):
+def extremes(values, n = 4):
+    # The n largest and n smallest values along each row, ignoring NaNs
+    # (as nlargest and nsmallest do), found by partitioning rather than sorting;
+    # each set is returned in ascending order, padded with NaNs
+    # where a row has fewer than n values:
+    k = min(n, values.shape[1])
+    valid = ~np.isnan(values)
+    highs = -np.partition(np.where(valid, -values, np.inf), k - 1, axis = 1)[:, :k]
+    lows = np.partition(np.where(valid, values, np.inf), k - 1, axis = 1)[:, :k]
+    highs = np.sort(np.where(np.isfinite(highs), highs, np.nan), axis = 1)
+    lows = np.sort(np.where(np.isfinite(lows), lows, np.nan), axis = 1)
+    return highs, lows
+
+def finite_mean(values):
+    # Row means of the values that are not NaN, summed in order
+    # (so that equal sets of extremes always give equal means):
+    finite = np.isfinite(values)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.where(finite, values, 0.).sum(axis = 1) / finite.sum(axis = 1)
+
+def extreme_means(values, n = 4):
+    # Means of the n largest and n smallest values along each row:
+    highs, lows = extremes(values, n)
+    return finite_mean(highs), finite_mean(lows)
+
+def day_score_matrix(values, dates, n = 4):
+    # Takes a (series x date) array and normalises each value
+    # between the means of the n lowest and n highest values
+    # its series takes on the same day of the week:
+    values = np.asarray(values, dtype = float)
+    days = pd.DatetimeIndex(dates).dayofweek.to_numpy()
+    out = np.full(values.shape, np.nan)
+    for day in np.unique(days):
+        cols = days == day
+        highs, lows = extreme_means(values[:, cols], n)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            out[:, cols] = (values[:, cols] - lows[:, None]) / (highs - lows)[:, None]
+    return out
+
+def calculate_day_scores(series, level = 'date', by = None, n = 4, state = None):
+    # Takes a series indexed by date (and, optionally, by some other level,
+    # e.g. name, naming separate series to be scored in the same call)
+    # and returns normalised values grouped by day of the week;
+    # given an incremental.WeekdayExtremes state (and by),
+    # only the days that are new since its last update are worked through.
+    if by is None:
+        dates = series.index.get_level_values(level)
+        scores = day_score_matrix(series.to_numpy()[None, :], dates, n)[0]
+        return pd.Series(scores, series.index)
+    matrix = series.unstack(level)
+    if state is None:
+        scores = day_score_matrix(matrix.to_numpy(), matrix.columns, n)
+    else:
+        assert state.n == n
+        scores = state.update(matrix.columns, matrix.index, matrix.to_numpy().T).T
+    rows = matrix.index.get_indexer(series.index.get_level_values(by))
+    cols = matrix.columns.get_indexer(series.index.get_level_values(level))
+    return pd.Series(scores[rows, cols], series.index)
+
+def calculate_averages(
+        frm,
+        level = 'date',
+        weightKey = 'pop',
+        bands = None,
+        by = 'name',
+        skipna = False,
+        ):
+    # Get a frame that contains averages by some chosen level,
+    # weighted by the weightKey column; as with np.average, an average
+    # over any NaN value (or weight) is NaN, unless skipna, which
+    # leaves such rows out of that column's average instead;
+    # given bands (a dict of labels to lists of names on the level by),
+    # one average is taken per band and level, indexed by (level, by).
+    keys = [col for col in frm.columns if not col == weightKey]
+    values = frm[keys].to_numpy(dtype = float)
+    weights = frm[weightKey].to_numpy(dtype = float)[:, None]
+    valid = ~(np.isnan(values) | np.isnan(weights))
+    xw = np.where(valid, values * weights, 0.)
+    w = np.where(valid, weights, 0.)
+    codes, groups = pd.factorize(frm.index.get_level_values(level), sort = True)
+    groups = pd.Index(groups, name = level)
+    nGroups, nKeys = len(groups), len(keys)
+    # One bincount over (group, column) cells sums every column at once:
+    cells = (codes[:, None] * nKeys + np.arange(nKeys)).ravel()
+    xw, w, invalid = xw.ravel(), w.ravel(), ~valid.ravel()
+    def averages(rows):
+        mask = np.repeat(rows, nKeys)
+        sums = np.bincount(cells[mask], xw[mask], nGroups * nKeys)
+        norms = np.bincount(cells[mask], w[mask], nGroups * nKeys)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            out = sums / norms
+        if not skipna:
+            out[np.bincount(cells[mask & invalid], minlength = nGroups * nKeys) > 0] = np.nan
+        out = out.reshape(nGroups, nKeys)
+        return pd.DataFrame(out, index = groups, columns = keys)
+    if bands is None:
+        return averages(np.ones(len(frm), dtype = bool))
+    labels = frm.index.get_level_values(by)
+    out = []
+    for band, names in bands.items():
+        bandFrm = averages(labels.isin(list(names)))
+        bandFrm[by] = band
+        out.append(bandFrm.reset_index().set_index([level, by]))
+    return pd.concat(out).sort_index()
+
+def add_band_averages(frm, bands):
+    # Adds one averaged series per band (named for the band),
+    # scored all in one call, assembling and sorting the frame once:
+    averages = calculate_averages(frm, bands = bands)
+    averages['score'] = calculate_day_scores(averages['score'], by = 'name')
+    return pd.concat([frm, averages]).sort_index()
+
+# Detection model behind adjust_stay: Facebook is taken to see
+# a fraction fbFrac of the population, and a journey to register
+# once it carries about fbThresh users per destination tile.
+FBFRAC = 1 / 10
+FBTHRESH = 10
+
+def adjust_stay(stay, km, pop, area, tileArea, fbFrac = FBFRAC, fbThresh = FBTHRESH):
+    # Corrects the 'stay' fraction for journeys too sparse to be detected.
+    # All arguments are aligned arrays (or scalars) and broadcast together,
+    # so e.g. fbFrac and fbThresh of shape (nSettings, 1) against rows of
+    # shape (nRows,) adjust for many settings at once:
+    popPerTile = pop * tileArea / area
+    destTiles = km ** 2 / tileArea
+    detChance = expit((popPerTile * fbFrac / destTiles - fbThresh) / fbThresh)
+    return 1. - np.minimum((1. - stay) / detChance, 1.)
+
+# Frames already built in this process, so that a state's frame
+# is shared by all the metros within it; each is stored with its sources
+# (see dataFrm_sources) and rebuilt when they change:
+DATAFRMS = dict()
+
+def make_inputFrm(region):
+
+    # The council-level mobility rows behind make_dataFrm,
+    # with council information added but 'stay' not yet adjusted.
 
     global dataDir
 
@@ -286,7 +395,6 @@ def make_dataFrm(region):
     dataName = f'mob_lga_{region}.csv'
     rawPath = os.path.join(dataDir, dataName)
     frm = pd.read_csv(rawPath)
-    cases = make_casesFrm()
 
     # Correct data types from csv
     frm['code'] = frm['code'].astype(int).astype(str)
@@ -298,10 +406,8 @@ def make_dataFrm(region):
 
     # Add council information from lookupFrm
     lookupFrm = make_lookupFrm()
-    codeFrm = lookupFrm.set_index('code').loc[frm['code']][['name', 'area', 'pop']]
-    frm = frm.set_index('code')
-    frm[['name', 'area', 'pop']] = codeFrm
-    frm = frm.reset_index()
+    lookupFrm = lookupFrm.drop_duplicates('code').set_index('code')[['name', 'area', 'pop']]
+    frm = frm.join(lookupFrm, on = 'code')
 
     # Trim brackets from council names
     frm['name'] = frm['name'].apply(remove_brackets)
@@ -312,17 +418,43 @@ def make_dataFrm(region):
     # Add a nominal distance travelled when below detection threshold
     frm['km'] = frm['km'].fillna(frm['km'].min() / 2)
 
+    return frm
+
+def dataFrm_sources(region, cases):
+    # What a memoised frame was built from: its mobility csv and any case data.
+    rawPath = os.path.join(dataDir, f'mob_lga_{region}.csv')
+    stat = os.stat(rawPath)
+    if cases and load.METROSTATES.get(region, region) in CASESTATES:
+        casesHash = casedata.raw_hash('gov')
+    else:
+        casesHash = None
+    return (stat.st_size, stat.st_mtime_ns, casesHash)
+
+def make_dataFrm(region, cases = True, fbFrac = FBFRAC, fbThresh = FBTHRESH, tileScale = 1.):
+
+    key = (region, cases, fbFrac, fbThresh, tileScale)
+    if key in DATAFRMS:
+        sources, frm = DATAFRMS[key]
+        if sources == dataFrm_sources(region, cases):
+            return frm.copy()
+    withCases = cases
+
+    frm = make_inputFrm(region)
+    if cases and load.METROSTATES.get(region, region) in CASESTATES:
+        cases = make_casesFrm(region)
+    else:
+        cases = None
+
     # Adjust 'stay' metric to account for detection cutoffs
-    tileArea = frm['km'].min() ** 2
-    popPerTile = frm['pop'] * tileArea / frm['area']
-    mob = (1. - frm['stay'])
-    fbFrac = 1 / 10
-    fbThresh = 10
-    destTiles = frm['km'] ** 2 / tileArea
-    detChance = expit((popPerTile * fbFrac / destTiles - fbThresh) / fbThresh)
-    trav = (mob / detChance).apply(lambda x: min(x, 1.))
-    adjStay = 1. - trav
-    frm['stay'] = adjStay
+    frm['stay'] = adjust_stay(
+        frm['stay'].to_numpy(dtype = float),
+        frm['km'].to_numpy(dtype = float),
+        frm['pop'].to_numpy(dtype = float),
+        frm['area'].to_numpy(dtype = float),
+        tileArea = frm['km'].min() ** 2 * tileScale,
+        fbFrac = fbFrac,
+        fbThresh = fbThresh,
+        )
 
     # Drop redundant columns
     frm = frm.drop(['area', 'code', 'weight'], axis = 1)
@@ -331,61 +463,81 @@ def make_dataFrm(region):
     frm = frm.set_index(['date', 'name'])
 
     # Get scores
-    scores = frm.groupby(level = 'name')['stay'].apply(calculate_day_scores)
-    scores = scores.reorder_levels([1, 0]).sort_index()
-    frm['score'] = scores
+    frm['score'] = calculate_day_scores(frm['stay'], by = 'name')
 
     # Add cases data
-    cases = cases.reindex(frm.index).loc[frm.index]
-    frm[cases.columns] = cases
+    if not cases is None:
+        cases = cases.reindex(frm.index).loc[frm.index]
+        frm[cases.columns] = cases
 
     # Get averages
     averages = calculate_averages(frm)
     averages['name'] = 'average'
-    averages = averages.reset_index().set_index(['date', 'name']).sort_index()
-    frm = frm.append(averages).sort_index()
+    averages = averages.reset_index().set_index(['date', 'name'])
 
-    # Final sort
-    frm = frm.sort_index()
+    # Assemble and sort once
+    frm = pd.concat([frm, averages]).sort_index()
 
     # Fill nans
     frm = frm.fillna(0.)
 
-    # Return:
-    return frm
+    # Return (the sources read afresh, as the case data may only now have been fetched):
+    DATAFRMS[key] = (dataFrm_sources(region, withCases), frm)
+    return frm.copy()
 
-def make_geometry(indices, region = 'vic'):
-    statesLookup = dict(
-        vic = 'Victoria',
-        mel = 'Victoria',
-        nsw = 'New South Wales',
-        syd = 'Sydney',
-        )
-    # Make a geometry frame from ABS data:
+def make_geometry(indices, region = 'vic', size = None):
+    # Make a geometry frame from ABS data
+    # for the councils of a state (or of the state around a metro):
+    state = load.METROSTATES.get(region, region)
     lgas = load.load_lgas()
-    lgas = lgas.loc[lgas['STE_NAME16'] == statesLookup[region]]
+    lgas = lgas.loc[lgas['STE_NAME16'] == load.STATENAMES[state]]
     lgas['name'] = lgas['name'].apply(remove_brackets)
-    lgas = lgas.set_index('name')
+    lgas.index.name = 'code'
+    lgas = lgas.reset_index().set_index('name')
     councils = [c for c in indices if c in lgas.index]
-    geometry = lgas['geometry'].loc[councils]
+    if size is None:
+        geometry = lgas['geometry'].loc[councils]
+    else:
+        # Pre-simplified for a map of the given size in pixels:
+        import pyramid
+        codes = lgas['code'].loc[councils]
+        geometry = pyramid.get_pyramid('lga').geometries(codes, size = size)
+        geometry.index = pd.Index(councils, name = 'name')
     return geometry
 
-def make_melvicFrm(dates = None, names = None):
+# Councils left out of a metro's dashboard:
+DASHEXCLUDE = dict(
+    mel = {'Greater Geelong', 'Queenscliffe', 'Surf Coast'},
+    )
+
+def make_dashFrm(
+        metro,
+        dates = None,
+        names = None,
+        keepState = True,
+        cases = True,
+        fbFrac = FBFRAC,
+        fbThresh = FBTHRESH,
+        tileScale = 1.,
+        ):
+
+    # The merged metro/state frame behind a metro's dashboard.
+    state = load.METROSTATES[metro]
 
     # Get component frames
-    melFrm = make_dataFrm('mel')
-    for key in {'Greater Geelong', 'Queenscliffe', 'Surf Coast'}:
-        if key in set(melFrm.index.get_level_values('name')):
-            melFrm = melFrm.drop(key, level = 'name')
-    vicFrm = make_dataFrm('vic')
-    indices = list(set.intersection(set(melFrm.index), set(vicFrm.index)))
-    melFrm = melFrm.loc[indices].sort_index()
-    vicFrm = vicFrm.loc[indices].sort_index()
+    metroFrm = make_dataFrm(metro, cases, fbFrac, fbThresh, tileScale)
+    for key in DASHEXCLUDE.get(metro, ()):
+        if key in set(metroFrm.index.get_level_values('name')):
+            metroFrm = metroFrm.drop(key, level = 'name')
+    stateFrm = make_dataFrm(state, cases, fbFrac, fbThresh, tileScale)
+    indices = metroFrm.index.intersection(stateFrm.index).sort_values()
+    metroFrm = metroFrm.loc[indices]
+    stateFrm = stateFrm.loc[indices]
 
     # Merge frames
-    frm = melFrm.copy()
-    frm['stay'] = melFrm['stay'] * (1. + vicFrm['stay']) / 2.
-    frm['km'] = (melFrm['km'] + vicFrm['km']) / 2
+    frm = metroFrm.copy()
+    frm['stay'] = metroFrm['stay'] * (1. + stateFrm['stay']) / 2.
+    frm['km'] = (metroFrm['km'] + stateFrm['km']) / 2
 
     # Optional selections:
     if not dates is None:
@@ -395,44 +547,35 @@ def make_melvicFrm(dates = None, names = None):
 
     # Get SEIFA data
     seifa = load.load_seifa()
-    seifa = seifa.loc[seifa['state'] == 'Victoria']
+    seifa = seifa.loc[seifa['state'] == load.STATENAMES[state]]
     seifa = seifa.set_index('name')['Index of Relative Socio-economic Disadvantage - Score']
     indices = set(frm.index.levels[1]).intersection(seifa.index)
-    seifa = seifa.loc[indices]
+    seifa = seifa.loc[sorted(indices)]
     import math
     lowSE = seifa.nsmallest(math.floor(len(seifa) / 3))
     highSE = seifa.nlargest(math.floor(len(seifa) / 3))
     midSE = seifa.loc[[key for key in seifa.index if not (key in lowSE.index or key in highSE.index)]]
 
-    # Calculate new scores
-    scores = frm.groupby(level = 'name')['stay'].apply(calculate_day_scores)
-    scores = scores.reorder_levels([1, 0]).sort_index()
-    frm['score'] = scores
+    # Calculate new scores (carrying the weekday extremes over
+    # from the last build with the same stay adjustment
+    # when the full history is in play)
+    if keepState and dates is None and names is None:
+        import incremental
+        stateName = '_'.join([metro + state, 'score', *[str(float(x)) for x in (fbFrac, fbThresh, tileScale)]])
+        scoreState = incremental.load_state(stateName, incremental.WeekdayExtremes(n = 4))
+        frm['score'] = calculate_day_scores(frm['stay'], by = 'name', state = scoreState)
+        incremental.save_state(stateName, scoreState)
+    else:
+        frm['score'] = calculate_day_scores(frm['stay'], by = 'name')
 
     # Set aside the non-average keys:
-    names = frm.index.levels[1]
+    names = sorted(set(frm.index.get_level_values('name')) - {'average'})
 
-    # Calculate new averages
+    # Calculate new averages and sub-averages, over one grouping
     frm = frm.drop('average', level = 'name')
-    averages = calculate_averages(frm)
-    averages['name'] = 'average'
-    averages = averages.reset_index().set_index(['date', 'name']).sort_index()
-    frm = frm.append(averages).sort_index()
-
-    # Calculate new average score
-    avScores = calculate_day_scores(frm['score'].xs('average', level = 'name'))
-    frm.loc[(slice(None), 'average'), 'score'] = avScores.to_list()
-
-    # Calculate sub-averages
-    for name, se in zip(['lowSE', 'midSE', 'highSE'], [lowSE, midSE, highSE]):
-        subNames = set(se.index).intersection(names)
-        subFrm = frm.loc[(slice(None), subNames),]
-        subAverages = calculate_averages(subFrm)
-        subAverages['name'] = name
-        subAverages = subAverages.reset_index().set_index(['date', 'name']).sort_index()
-        frm = frm.append(subAverages).sort_index()
-        avScores = calculate_day_scores(frm['score'].xs(name, level = 'name'))
-        frm.loc[(slice(None), name), 'score'] = avScores.to_list()
+    bands = dict(average = names, lowSE = lowSE.index, midSE = midSE.index, highSE = highSE.index)
+    bands = {name: sorted(set(subNames).intersection(names)) for name, subNames in bands.items()}
+    frm = add_band_averages(frm, bands)
 
     # Drop redundant columns
     frm = frm.drop('pop', axis = 1)
@@ -441,4 +584,7 @@ def make_melvicFrm(dates = None, names = None):
     frm = frm.fillna(0.)
 
     # Return
-    return frm
\ No newline at end of file
+    return frm
+
+def make_melvicFrm(dates = None, names = None, keepState = True):
+    return make_dashFrm('mel', dates, names, keepState)
@@ -0,0 +1,310 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import load
+import aggregate
+
+def timed(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+def bench_dask_aggregation(region = 'vic', aggType = 'lga', nWorkers = None, chunkSize = 7):
+
+    import parallel
+
+    mob = load.load_fb_tiles(region, 'mob')
+
+    # Warm the weights caches so both paths are timed on equal terms:
+    parallel.prepare_shared(mob, aggType)
+
+    serial, serialTime = timed(
+        lambda: aggregate.aggregate_by_date(
+            aggregate.aggregate_mob_tiles_to_abs(mob, region, aggType)
+            )
+        )
+    dasked, daskTime = timed(
+        parallel.aggregate_mob_tiles_dask,
+        mob,
+        region,
+        aggType,
+        nWorkers = nWorkers,
+        chunkSize = chunkSize,
+        )
+
+    out = dict(
+        serial = serialTime,
+        dask = daskTime,
+        speedup = serialTime / daskTime,
+        identical = parallel.frames_match(serial, dasked),
+        )
+    print(out)
+    return out
+
+def legacy_derive_mob_counts(agg):
+    # The groupby-based derivation make_mob_date used before
+    # derive_mob_counts, kept as the reference for bench_derive_mob_counts:
+    frm = agg.copy()
+    frm = frm.reset_index()
+    frm['n'] *= frm['weight']
+    frm['km'] *= frm['n']
+    frm.loc[frm['km'] == 0., 'stay'] = frm['n']
+
+    trav = frm.loc[frm['start'] != frm['stop']].loc[frm['km'] > 0.].copy()
+    dateN = trav.groupby('date')['n'].aggregate(sum)
+    stopCounts = trav.groupby(['date', 'stop'])['n'].aggregate(sum)
+    visit = stopCounts / dateN
+    visit.index.names = ['date', 'code']
+
+    frm = frm.rename(dict(start = 'code'), axis = 1)
+    frm['code'] = frm['code'].astype(int)
+    frm = frm.set_index(['date', 'code'])
+    frm = frm.drop('stop', axis = 1)
+
+    frm = aggregate.aggregate_identicals(
+        frm,
+        n = 'sum',
+        km = 'sum',
+        stay = 'sum'
+        )
+    frm['stay'] /= frm['n']
+    frm['km'] = frm['km'] / (frm['n'] * (1. - frm['stay']))
+    frm['visit'] = visit
+    frm['visit'] = frm['visit'].fillna(0.)
+    frm.index = frm.index.set_levels(
+        pd.to_datetime(frm.index.levels[0]),
+        level = 'date'
+        )
+    return frm
+
+def bench_derive_mob_counts(region = 'nsw', aggType = 'lga', repeats = 3):
+
+    import produce
+
+    mob = load.load_fb_tiles(region, 'mob')
+    agg = aggregate.aggregate_mob_tiles_to_abs(mob, region, aggType)
+    agg = aggregate.aggregate_by_date(agg)
+
+    legacyTimes, fusedTimes = [], []
+    for _ in range(repeats):
+        legacy, legacyTime = timed(legacy_derive_mob_counts, agg)
+        fused, fusedTime = timed(produce.derive_mob_counts, agg)
+        legacyTimes.append(legacyTime)
+        fusedTimes.append(fusedTime)
+
+    legacy = legacy[fused.columns]
+    out = dict(
+        rows = len(agg),
+        legacy = min(legacyTimes),
+        fused = min(fusedTimes),
+        speedup = min(legacyTimes) / min(fusedTimes),
+        identical = legacy.index.equals(fused.index) and np.allclose(
+            legacy.values, fused.values, equal_nan = True
+            ),
+        )
+    print(out)
+    return out
+
+def geojson_matches(reference, written, precision):
+    # Whether bokeh would read written as it would reference:
+    # the same properties (missing ones being NaN, as nulls are)
+    # and the same polygon exteriors to within the precision.
+    import json
+    ref, out = json.loads(reference)['features'], json.loads(written)['features']
+    if not len(ref) == len(out):
+        return False
+    keys = set().union(*[f['properties'] for f in out])
+    for a, b in zip(ref, out):
+        for key, value in a['properties'].items():
+            if value is None:
+                if b['properties'].get(key) is not None:
+                    return False
+            elif not key in keys or not b['properties'].get(key) == value:
+                return False
+        geomA, geomB = a['geometry'], b['geometry']
+        if geomA is None or geomB is None:
+            if not geomA is geomB:
+                return False
+            continue
+        polysA, polysB = geomA['coordinates'], geomB['coordinates']
+        if geomA['type'] == 'Polygon':
+            polysA, polysB = [polysA], [polysB]
+        for polyA, polyB in zip(polysA, polysB):
+            ringA, ringB = np.array(polyA[0]), np.array(polyB[0])
+            if not ringA.shape == ringB.shape:
+                return False
+            if np.abs(ringA - ringB).max() > 0.5001 * 10 ** -precision:
+                return False
+    return True
+
+def bench_geojson(region = 'vic', aggType = 'lga', precision = 5, repeats = 3):
+
+    import os
+    import produce
+    import geowrite
+
+    raw = produce.load_mob_date(
+        os.path.join(produce.dataDir, '_'.join(['mob', aggType, region]) + '.csv')
+        )
+    frm = produce.make_mob_dateMap_frame(raw, aggType).reset_index()
+
+    writers = dict(
+        to_json = lambda: frm.to_json(),
+        geowrite = lambda: geowrite.to_geojson(
+            frm, precision = precision, interiors = False
+            ),
+        geowrite_delta = lambda: geowrite.to_geojson(
+            frm, precision = precision, delta = True, interiors = False
+            ),
+        )
+    times, texts = dict(), dict()
+    for name, writer in writers.items():
+        timings = []
+        for _ in range(repeats):
+            texts[name], seconds = timed(writer)
+            timings.append(seconds)
+        times[name] = min(timings)
+
+    out = dict(features = len(frm))
+    for name in writers:
+        out[name] = dict(
+            seconds = times[name],
+            megabytes = len(texts[name].encode()) / 2 ** 20,
+            speedup = times['to_json'] / times[name],
+            )
+    out['compatible'] = geojson_matches(texts['to_json'], texts['geowrite'], precision)
+    print(out)
+    return out
+
+def legacy_day_scores(series, level = 'date', n = 4):
+    # calculate_day_scores as it was before it was vectorized:
+    index = series.index.get_level_values(level)
+    series = pd.DataFrame(data = dict(
+        val = series.values,
+        date = index,
+        day = [int(d.strftime('%w')) for d in index.tolist()]
+        )).set_index([level, 'day'])['val']
+    groups = series.groupby(level = 'day')
+    highs = groups.apply(lambda s: s.nlargest(n).mean())
+    lows = groups.apply(lambda s: s.nsmallest(n).mean())
+    series = (series - lows) / (highs - lows)
+    return pd.Series(series.values, index)
+
+def legacy_averages(frm, level = 'date', weightKey = 'pop'):
+    serieses = dict()
+    for key in [col for col in frm.columns if not col == weightKey]:
+        fn = lambda f: np.average(f[key], weights = f[weightKey])
+        serieses[key] = frm[[key, weightKey]].groupby(level = level).apply(fn)
+    return pd.DataFrame(serieses)
+
+def legacy_band_averages(frm, bands):
+    # The append-and-sort loop make_melvicFrm used before add_band_averages
+    # (with pd.concat standing in for DataFrame.append):
+    frm = frm.copy()
+    for name, subNames in bands.items():
+        subAverages = legacy_averages(frm.loc[(slice(None), subNames),])
+        subAverages['name'] = name
+        subAverages = subAverages.reset_index().set_index(['date', 'name']).sort_index()
+        frm = pd.concat([frm, subAverages]).sort_index()
+        avScores = legacy_day_scores(frm['score'].xs(name, level = 'name'))
+        frm.loc[(slice(None), name), 'score'] = avScores.to_list()
+    return frm
+
+def bench_band_averages(nCouncils = 79, nDays = 365, repeats = 3, seed = 0, nanFrac = 0.01):
+
+    # The averaging and scoring stage of the dashboard frame build
+    # (analysis.make_melvicFrm), on a synthetic frame of its shape
+    # with a fraction nanFrac of the stay and case values missing:
+
+    import analysis
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-03-01', periods = nDays)
+    names = ['council_' + str(i) for i in range(nCouncils)]
+    index = pd.MultiIndex.from_product([dates, names], names = ['date', 'name'])
+    frm = pd.DataFrame(
+        dict(
+            stay = rng.random(len(index)),
+            km = rng.random(len(index)) * 10.,
+            new = rng.random(len(index)),
+            new_rolling = rng.random(len(index)),
+            cumulative = rng.random(len(index)),
+            pop = np.tile(rng.integers(1000, 300000, nCouncils), nDays).astype(float),
+            ),
+        index = index,
+        )
+    for key in ['stay', 'new', 'new_rolling']:
+        frm.loc[rng.random(len(frm)) < nanFrac, key] = np.nan
+
+    t0 = time.perf_counter()
+    frm['score'] = analysis.calculate_day_scores(frm['stay'], by = 'name')
+    scoreTime = time.perf_counter() - t0
+    thirds = np.array_split(np.array(names), 3)
+    bands = dict(
+        average = names,
+        lowSE = list(thirds[0]),
+        midSE = list(thirds[1]),
+        highSE = list(thirds[2]),
+        )
+
+    legacyTimes, newTimes = [], []
+    for _ in range(repeats):
+        legacy, legacyTime = timed(legacy_band_averages, frm, bands)
+        new, newTime = timed(analysis.add_band_averages, frm, bands)
+        legacyTimes.append(legacyTime)
+        newTimes.append(newTime)
+
+    out = dict(
+        rows = len(frm),
+        scores = scoreTime,
+        legacy = min(legacyTimes),
+        new = min(newTimes),
+        speedup = min(legacyTimes) / min(newTimes),
+        identical = legacy.index.equals(new.index) and np.allclose(
+            legacy[new.columns].values, new.values, equal_nan = True
+            ),
+        )
+    print(out)
+    return out
+
+def bench_sweep(region = 'vic', nFracs = 10, nThreshs = 10, nScales = 3, nWorkers = None):
+
+    # A grid of stay-adjustment settings swept in batch (sweep.sweep)
+    # against one make_dataFrm per setting, timed on a sample of the grid:
+
+    import analysis
+    import sweep
+
+    fbFracs = list(np.geomspace(0.02, 0.5, nFracs))
+    fbThreshs = list(np.geomspace(2., 50., nThreshs))
+    tileScales = list(np.geomspace(0.5, 2., nScales))
+    nSettings = nFracs * nThreshs * nScales
+
+    cube, sweepTime = timed(
+        sweep.sweep, region, fbFracs, fbThreshs, tileScales, nWorkers = nWorkers
+        )
+
+    sample = [(fbFracs[0], fbThreshs[-1], tileScales[0]), (fbFracs[-1], fbThreshs[0], tileScales[-1])]
+    loopTimes, identical = [], True
+    for fbFrac, fbThresh, tileScale in sample:
+        ref, loopTime = timed(
+            analysis.make_dataFrm, region, False, fbFrac, fbThresh, tileScale
+            )
+        loopTimes.append(loopTime)
+        got = cube.loc[(fbFrac, fbThresh, tileScale)]
+        identical &= got.index.equals(ref.index) and np.allclose(
+            got.values, ref[got.columns].values, equal_nan = True
+            )
+
+    out = dict(
+        settings = nSettings,
+        rows = len(cube),
+        sweep = sweepTime,
+        loop = np.mean(loopTimes) * nSettings,
+        speedup = np.mean(loopTimes) * nSettings / sweepTime,
+        identical = identical,
+        )
+    print(out)
+    return out
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import hashlib
+import urllib.request
+import urllib.error
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+repoPath = os.path.abspath(os.path.dirname(__file__))
+casesDir = os.path.join(repoPath, 'resources', 'cases')
+
+# The remote COVID case tables behind analysis.make_casesFrm_*.
+#
+# Each source is downloaded into resources/cases beside a record of its
+# ETag and Last-Modified headers, and revalidated with a conditional
+# request (so an unchanged table costs a 304 rather than a download);
+# if the network is unavailable the cached copy is used.
+# The parsed table is kept beside it as one array per column (.npz),
+# keyed by the raw file's content, so it is only reparsed when it changes;
+# and within a process each source is fetched and parsed at most once.
+#
+# For offline runs (and tests), a directory holding files named for
+# the sources (e.g. gov.csv) stands in for the network; it can be given
+# to get_table or set once through the MOBILITY_CASES_DIR variable.
+
+SOURCES = dict(
+    gov = dict(
+        url = 'https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv',
+        ext = '.csv',
+        dates = ['diagnosis_date'],
+        ),
+    covidlive = dict(
+        url = 'https://covidlive.com.au/covid-live-loc.json',
+        ext = '.json',
+        dates = ['REPORT_DATE'],
+        ),
+    monash = dict(
+        url = 'https://homepages.inf.ed.ac.uk/ngoddard/covid19/vicdata/lgadata.csv',
+        ext = '.csv',
+        dates = [],
+        ),
+    )
+
+OFFLINE_DIR = os.environ.get('MOBILITY_CASES_DIR')
+
+TABLES = dict()
+
+def raw_path(source, directory = None):
+    directory = casesDir if directory is None else directory
+    return os.path.join(directory, source + SOURCES[source]['ext'])
+
+def meta_path(source):
+    return os.path.join(casesDir, source + '.meta.json')
+
+def read_meta(source):
+    path = meta_path(source)
+    if not os.path.isfile(path):
+        return dict()
+    with open(path) as f:
+        return json.load(f)
+
+def fetch(source, revalidate = True, timeout = 30):
+    # Brings the cached raw file up to date, returning its path:
+    path = raw_path(source)
+    meta = read_meta(source) if os.path.isfile(path) else dict()
+    if meta and not revalidate:
+        return path
+    request = urllib.request.Request(SOURCES[source]['url'])
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('lastModified'):
+        request.add_header('If-Modified-Since', meta['lastModified'])
+    try:
+        with urllib.request.urlopen(request, timeout = timeout) as response:
+            data = response.read()
+            headers = response.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            print("Case data unchanged:", source)
+            return path
+        if meta:
+            print("Could not refresh case data, using cached copy:", source, e)
+            return path
+        raise
+    except (urllib.error.URLError, OSError) as e:
+        if meta:
+            print("Could not refresh case data, using cached copy:", source, e)
+            return path
+        raise
+    print("Downloaded case data:", source)
+    if not os.path.isdir(casesDir):
+        os.makedirs(casesDir)
+    with utils.atomic_path(path) as tempPath:
+        with open(tempPath, 'wb') as f:
+            f.write(data)
+    meta = dict(
+        url = SOURCES[source]['url'],
+        etag = headers.get('ETag'),
+        lastModified = headers.get('Last-Modified'),
+        fetched = time.strftime('%Y-%m-%dT%H:%M:%S'),
+        )
+    with utils.atomic_path(meta_path(source)) as tempPath:
+        with open(tempPath, 'w') as f:
+            json.dump(meta, f)
+    return path
+
+def parse(source, path):
+    options = SOURCES[source]
+    if options['ext'] == '.json':
+        frm = pd.read_json(path, convert_dates = False)
+    else:
+        frm = pd.read_csv(path)
+    for key in options['dates']:
+        frm[key] = pd.to_datetime(frm[key])
+    return frm
+
+def save_columns(frm, path):
+    # One array per column; text columns as unicode arrays with a null mask,
+    # so that nothing needs pickling:
+    arrays = dict()
+    for i, key in enumerate(frm.columns):
+        series = frm[key]
+        if series.dtype.kind in 'biufMm':
+            arrays['v' + str(i)] = series.to_numpy()
+        else:
+            nulls = series.isnull().to_numpy()
+            arrays['o' + str(i)] = np.array(
+                ['' if null else str(v) for v, null in zip(series.tolist(), nulls)],
+                dtype = str,
+                )
+            arrays['n' + str(i)] = nulls
+    arrays['columns'] = np.array([str(key) for key in frm.columns])
+    with utils.atomic_path(path) as tempPath:
+        with open(tempPath, 'wb') as f:
+            np.savez(f, **arrays)
+
+def load_columns(path):
+    with np.load(path, allow_pickle = False) as arrays:
+        columns = dict()
+        for i, key in enumerate(arrays['columns'].tolist()):
+            if 'v' + str(i) in arrays:
+                columns[key] = arrays['v' + str(i)]
+            else:
+                values = arrays['o' + str(i)].astype(object)
+                values[arrays['n' + str(i)]] = None
+                columns[key] = values
+    return pd.DataFrame(columns)
+
+def raw_hash(source, offline = None):
+    # The content hash of the raw file get_table would read,
+    # without fetching; None if there is none yet:
+    offline = OFFLINE_DIR if offline is None else offline
+    path = raw_path(source, offline) if offline else raw_path(source)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+def get_table(source, offline = None, revalidate = True):
+    # The parsed table for a source, as a fresh copy;
+    # the memo is only reused while the raw file on disk is unchanged:
+    if source in TABLES:
+        content, frm = TABLES[source]
+        if content == raw_hash(source, offline):
+            return frm.copy()
+    offline = OFFLINE_DIR if offline is None else offline
+    if offline:
+        path = raw_path(source, offline)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+    else:
+        path = fetch(source, revalidate)
+    with open(path, 'rb') as f:
+        content = hashlib.sha256(f.read()).hexdigest()[:16]
+    parsedPath = os.path.join(casesDir, '_'.join([source, content]) + '.npz')
+    if os.path.isfile(parsedPath):
+        frm = load_columns(parsedPath)
+    else:
+        frm = parse(source, path)
+        if not os.path.isdir(casesDir):
+            os.makedirs(casesDir)
+        save_columns(frm, parsedPath)
+        # Parsed copies of superseded downloads are of no further use:
+        for filename in os.listdir(casesDir):
+            if filename.startswith(source + '_') and filename.endswith('.npz'):
+                if not filename == os.path.basename(parsedPath):
+                    os.remove(os.path.join(casesDir, filename))
+    TABLES[source] = (content, frm)
+    return frm.copy()
+
+def clear():
+    TABLES.clear()
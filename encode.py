@@ -0,0 +1,401 @@
+import numpy as np
+import pandas as pd
+
+# Compact encodings for shipping geometry and data to the browser.
+#
+# Geometry is stored TopoJSON-style: polygon exteriors are quantized
+# to an integer grid, cut into arcs wherever boundaries meet,
+# and each shared boundary is stored once (delta-encoded) and referenced
+# by both regions (as ~i where it is traversed in reverse).
+# Values are stored as one flat float32 array per metric,
+# date-major, which bokeh ships as base64 typed arrays.
+
+def polygon_exteriors(geom):
+    # Like GeoJSONDataSource, only exteriors are drawn:
+    if geom is None or geom.is_empty:
+        return []
+    if geom.geom_type == 'Polygon':
+        return [np.asarray(geom.exterior.coords)[:, :2]]
+    if geom.geom_type == 'MultiPolygon':
+        return [np.asarray(g.exterior.coords)[:, :2] for g in geom.geoms]
+    raise TypeError(geom.geom_type)
+
+def make_transform(bounds, quantization):
+    minx, miny, maxx, maxy = bounds
+    kx = (maxx - minx) / (quantization - 1) if maxx > minx else 1.
+    ky = (maxy - miny) / (quantization - 1) if maxy > miny else 1.
+    return dict(scale = [kx, ky], translate = [minx, miny])
+
+def quantize_ring(ring, transform):
+    (kx, ky), (tx, ty) = transform['scale'], transform['translate']
+    out = np.empty(ring.shape, dtype = np.int64)
+    out[:, 0] = np.round((ring[:, 0] - tx) / kx)
+    out[:, 1] = np.round((ring[:, 1] - ty) / ky)
+    # Drop points that collapse onto their predecessor:
+    keep = np.ones(len(out), dtype = bool)
+    keep[1:] = np.any(out[1:] != out[:-1], axis = 1)
+    return out[keep]
+
+def find_junctions(rings):
+    # A point is a junction wherever the boundaries through it differ,
+    # i.e. it is met with a different pair of neighbours somewhere else:
+    neighbours = dict()
+    junctions = set()
+    for ring in rings:
+        pts = [tuple(p) for p in ring[:-1]]
+        n = len(pts)
+        for i, p in enumerate(pts):
+            pair = frozenset((pts[i - 1], pts[(i + 1) % n]))
+            if p in neighbours:
+                if not neighbours[p] == pair:
+                    junctions.add(p)
+            else:
+                neighbours[p] = pair
+    return junctions
+
+def cut_ring(ring, junctions):
+    pts = ring[:-1]
+    cuts = [i for i, p in enumerate(map(tuple, pts)) if p in junctions]
+    if not cuts:
+        return [ring]
+    # Rotate to start on a junction, then cut at every junction:
+    rotated = np.concatenate([pts[cuts[0]:], pts[:cuts[0]], pts[cuts[0]:cuts[0] + 1]])
+    cuts = [i - cuts[0] for i in cuts] + [len(pts)]
+    return [rotated[a : b + 1] for a, b in zip(cuts[:-1], cuts[1:])]
+
+def simplify_arc(arc, tolerance):
+    # Arc endpoints are kept, so neighbouring regions stay watertight,
+    # and the arc is kept from crossing itself:
+    if tolerance is None or len(arc) < 3:
+        return arc
+    from shapely.geometry import LineString
+    line = LineString(arc).simplify(tolerance, preserve_topology = True)
+    out = np.round(np.asarray(line.coords)).astype(np.int64)
+    if np.all(arc[0] == arc[-1]) and len(out) < 4:
+        # A closed arc (an island) is kept as at least a quadrilateral:
+        return arc[np.linspace(0, len(arc) - 1, 4).astype(int)]
+    if len(out) < 2:
+        return arc[[0, -1]]
+    return out
+
+def build_arcs(geoms, quantization = 1e5):
+    # Quantizes the exteriors of geoms and cuts them into shared arcs,
+    # returning (transform, arcs, shapes): arcs as integer point arrays,
+    # shapes as, per geometry, its rings as lists of arc references.
+    geoms = list(geoms)
+    allRings = [polygon_exteriors(geom) for geom in geoms]
+    flat = [ring for rings in allRings for ring in rings]
+    if len(flat):
+        stacked = np.concatenate(flat)
+        bounds = (*stacked.min(axis = 0), *stacked.max(axis = 0))
+    else:
+        bounds = (0., 0., 1., 1.)
+    transform = make_transform(bounds, int(quantization))
+
+    quantized = [
+        [q for q in (quantize_ring(ring, transform) for ring in rings) if len(q) >= 4]
+            for rings in allRings
+        ]
+    junctions = find_junctions([q for rings in quantized for q in rings])
+
+    arcs, arcIndex = [], dict()
+    def reference(arc):
+        key = arc.tobytes()
+        if key in arcIndex:
+            return arcIndex[key]
+        revKey = arc[::-1].copy().tobytes()
+        if revKey in arcIndex:
+            return ~arcIndex[revKey]
+        i = len(arcs)
+        arcs.append(arc)
+        arcIndex[key] = i
+        return i
+
+    shapes = []
+    for rings in quantized:
+        shape = []
+        for ring in rings:
+            shape.append([reference(arc) for arc in cut_ring(ring, junctions)])
+        shapes.append(shape)
+
+    return transform, arcs, shapes
+
+def simplify_arcs(arcs, transform, tolerance):
+    # Each shared arc is simplified once, for all the shapes using it;
+    # tolerance is in geometry units:
+    if tolerance is None:
+        return list(arcs)
+    qTolerance = tolerance / max(transform['scale'])
+    return [simplify_arc(arc, qTolerance) for arc in arcs]
+
+def pack_topology(transform, arcs, shapes):
+    # Keeps only the arcs the shapes use, renumbered in order of use,
+    # and delta-encodes them into one flat int32 array:
+    used = dict()
+    for shape in shapes:
+        for ring in shape:
+            for ref in ring:
+                i = ~ref if ref < 0 else ref
+                if not i in used:
+                    used[i] = len(used)
+    remap = lambda ref: ~used[~ref] if ref < 0 else used[ref]
+    shapes = [[[remap(ref) for ref in ring] for ring in shape] for shape in shapes]
+    arcs = [arcs[i] for i in used]
+    offsets = np.zeros(len(arcs) + 1, dtype = np.int32)
+    offsets[1:] = np.cumsum([len(arc) for arc in arcs])
+    deltas = [np.diff(arc, axis = 0, prepend = [[0, 0]]) for arc in arcs]
+    if len(deltas):
+        coords = np.concatenate(deltas).astype(np.int32).ravel()
+    else:
+        coords = np.zeros(0, dtype = np.int32)
+    return dict(
+        transform = transform,
+        coords = coords,
+        offsets = offsets,
+        shapes = shapes,
+        )
+
+def make_topology(geoms, quantization = 1e5, tolerance = None):
+    # Returns dict(transform, coords, offsets, shapes) where
+    # coords (int32) are the delta-encoded arc points, x and y interleaved;
+    # offsets (int32) give each arc's first point, in points;
+    # shapes lists, per geometry, its rings as lists of arc references.
+    # A tolerance (in geometry units) simplifies each arc independently.
+    transform, arcs, shapes = build_arcs(geoms, quantization)
+    arcs = simplify_arcs(arcs, transform, tolerance)
+    return pack_topology(transform, arcs, shapes)
+
+def decode_arc(topology, ref):
+    i = ~ref if ref < 0 else ref
+    a, b = topology['offsets'][i], topology['offsets'][i + 1]
+    pts = np.cumsum(topology['coords'].reshape(-1, 2)[a : b], axis = 0)
+    (kx, ky), (tx, ty) = topology['transform']['scale'], topology['transform']['translate']
+    pts = pts * [kx, ky] + [tx, ty]
+    return pts[::-1] if ref < 0 else pts
+
+def decode_topology(topology):
+    # Reference decoder (the browser runs TOPOLOGY_JS instead):
+    from shapely.geometry import Polygon, MultiPolygon
+    out = []
+    for shape in topology['shapes']:
+        polys = []
+        for ring in shape:
+            arcs = [decode_arc(topology, ref) for ref in ring]
+            pts = np.concatenate([arcs[0], *[arc[1:] for arc in arcs[1:]]])
+            # Rings simplified down to a line are dropped:
+            if len(pts) >= 4:
+                polys.append(Polygon(pts))
+        if not polys:
+            out.append(None)
+        elif len(polys) == 1:
+            out.append(polys[0])
+        else:
+            out.append(MultiPolygon(polys))
+    return out
+
+# Expects `topo` (the topology, with coords and offsets as typed arrays)
+# and defines decode_shapes(topo) -> [xs, ys], one NaN-separated
+# array of exteriors per shape, as the patches glyph expects:
+TOPOLOGY_JS = """
+    function decode_arc(topo, ref) {
+        const i = ref < 0 ? ~ref : ref
+        const [kx, ky] = topo.transform.scale
+        const [tx, ty] = topo.transform.translate
+        const start = topo.offsets[i], end = topo.offsets[i + 1]
+        const xs = [], ys = []
+        let x = 0, y = 0
+        for (let k = start; k < end; k++) {
+            x += topo.coords[2 * k]
+            y += topo.coords[2 * k + 1]
+            xs.push(x * kx + tx)
+            ys.push(y * ky + ty)
+            }
+        if (ref < 0) {
+            xs.reverse()
+            ys.reverse()
+            }
+        return [xs, ys]
+        }
+    function decode_shapes(topo) {
+        const allXs = [], allYs = []
+        for (const shape of topo.shapes) {
+            const xs = [], ys = []
+            shape.forEach((ring, r) => {
+                if (r > 0) {
+                    xs.push(NaN)
+                    ys.push(NaN)
+                    }
+                ring.forEach((ref, a) => {
+                    const [axs, ays] = decode_arc(topo, ref)
+                    const skip = a > 0 ? 1 : 0
+                    for (let k = skip; k < axs.length; k++) {
+                        xs.push(axs[k])
+                        ys.push(ays[k])
+                        }
+                    })
+                })
+            allXs.push(xs)
+            allYs.push(ys)
+            }
+        return [allXs, allYs]
+        }
+    """
+
+def pack_values(frm, keys, dateLevel = 'date', indexLevel = 'code', codes = None):
+    # One flat float32 array per key, laid out [date][region],
+    # with missing entries as NaN:
+    dates = sorted(set(frm.index.get_level_values(dateLevel)))
+    if codes is None:
+        codes = sorted(set(frm.index.get_level_values(indexLevel)))
+    grid = pd.MultiIndex.from_product([dates, codes], names = [dateLevel, indexLevel])
+    frm = frm.reorder_levels([dateLevel, indexLevel])[list(keys)]
+    frm = frm.loc[~frm.index.duplicated()].reindex(grid)
+    values = {key: frm[key].to_numpy(dtype = np.float32) for key in keys}
+    return dates, list(codes), values
+
+def write_shards(cube, varNames, dates, outDir, period = 'M'):
+    # Writes a [variable][date][series] float32 cube as one raw
+    # little-endian file per variable and period (e.g. month),
+    # '<variable>_<period>.bin' laid out [date][series],
+    # plus an index.json listing the dates and which shard holds each.
+    # Shards whose bytes are unchanged are left untouched,
+    # so only the newest period is rewritten as history grows.
+    import os
+    import json
+    import utils
+    cube = np.asarray(cube, dtype = '<f4')
+    nVars, nDates, nSeries = cube.shape
+    periods = [str(p) for p in pd.DatetimeIndex(dates).to_period(period)]
+    shards, start = [], 0
+    for i in range(1, nDates + 1):
+        if i == nDates or not periods[i] == periods[start]:
+            shards.append(dict(period = periods[start], start = start, stop = i))
+            start = i
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    written = set()
+    for v, varName in enumerate(varNames):
+        for shard in shards:
+            filename = '_'.join([varName, shard['period']]) + '.bin'
+            data = cube[v, shard['start'] : shard['stop']].tobytes()
+            written.add(filename)
+            path = os.path.join(outDir, filename)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    if f.read() == data:
+                        continue
+            with utils.atomic_path(path) as tempPath:
+                with open(tempPath, 'wb') as f:
+                    f.write(data)
+    for filename in os.listdir(outDir):
+        if filename.endswith('.bin') and not filename in written:
+            os.remove(os.path.join(outDir, filename))
+    index = dict(
+        vars = list(varNames),
+        nSeries = nSeries,
+        dates = [int(pd.Timestamp(t).value // 10 ** 6) for t in dates],
+        shards = shards,
+        )
+    with utils.atomic_path(os.path.join(outDir, 'index.json')) as tempPath:
+        with open(tempPath, 'w') as f:
+            json.dump(index, f)
+    return index
+
+# Two interchangeable stores of [variable][date][series] values:
+# CubeStore over a cube embedded in the page, and ShardStore over
+# the files written by write_shards, fetched (once each) as needed.
+# Both return promises, from at(varName, t) for the values on the
+# latest date on or before t, and from series(varName) for the whole
+# history laid out [date][series]; index() gives dates and nSeries.
+# get_store keeps one store per key for the life of the page.
+STORES_JS = """
+    function latest_index(dates, t) {
+        let lo = 0, hi = dates.length - 1
+        while (lo < hi) {
+            const mid = (lo + hi + 1) >> 1
+            if (dates[mid] <= t) {
+                lo = mid
+                } else {
+                hi = mid - 1
+                }
+            }
+        return lo
+        }
+    class CubeStore {
+        constructor(cube, varNames, dates, nSeries) {
+            this.cube = cube
+            this.varNames = varNames
+            this._index = {vars: varNames, dates: dates, nSeries: nSeries}
+            }
+        index() {
+            return Promise.resolve(this._index)
+            }
+        block(varName) {
+            const size = this._index.dates.length * this._index.nSeries
+            const v = this.varNames.indexOf(varName)
+            return this.cube.slice(v * size, (v + 1) * size)
+            }
+        at(varName, t) {
+            const n = this._index.nSeries
+            const d = latest_index(this._index.dates, t)
+            const v = this.varNames.indexOf(varName)
+            const start = (v * this._index.dates.length + d) * n
+            return Promise.resolve(this.cube.slice(start, start + n))
+            }
+        series(varName) {
+            return Promise.resolve(this.block(varName))
+            }
+        }
+    class ShardStore {
+        constructor(url) {
+            this.url = url
+            this.shards = {}
+            this._index = null
+            }
+        index() {
+            if (this._index === null) {
+                this._index = fetch(this.url + '/index.json').then(r => r.json())
+                }
+            return this._index
+            }
+        shard(varName, s) {
+            return this.index().then(index => {
+                const key = varName + '_' + index.shards[s].period
+                if (!(key in this.shards)) {
+                    this.shards[key] = fetch(this.url + '/' + key + '.bin')
+                        .then(r => r.arrayBuffer())
+                        .then(b => new Float32Array(b))
+                    }
+                return this.shards[key]
+                })
+            }
+        at(varName, t) {
+            return this.index().then(index => {
+                const d = latest_index(index.dates, t)
+                const s = index.shards.findIndex(sh => sh.start <= d && d < sh.stop)
+                const n = index.nSeries, i = d - index.shards[s].start
+                return this.shard(varName, s).then(arr => arr.slice(i * n, (i + 1) * n))
+                })
+            }
+        series(varName) {
+            return this.index().then(index => Promise.all(
+                index.shards.map((sh, s) => this.shard(varName, s))
+                ).then(arrs => {
+                    const out = new Float32Array(index.dates.length * index.nSeries)
+                    let offset = 0
+                    for (const arr of arrs) {
+                        out.set(arr, offset)
+                        offset += arr.length
+                        }
+                    return out
+                    }))
+            }
+        }
+    function get_store(key, make) {
+        window._dashStores = window._dashStores || {}
+        if (!(key in window._dashStores)) {
+            window._dashStores[key] = make()
+            }
+        return window._dashStores[key]
+        }
+    """
@@ -0,0 +1,227 @@
+import os
+import time
+import heapq
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import load
+
+# Run under MPI with e.g.:
+#     mpirun -np 8 python3 update.py
+# or as a plain process, in which case a process pool is used instead.
+
+def get_comm():
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        return None
+    comm = MPI.COMM_WORLD
+    if comm.size > 1:
+        return comm
+    return None
+
+def is_root():
+    comm = get_comm()
+    return comm is None or comm.rank == 0
+
+def job_size(region, aggType = None):
+    # Proxy for cost: the bytes of raw tile data behind the job.
+    subDir = load.FBURLS[region]['mob']['tiles']
+    if subDir is None:
+        return 0
+    searchDir = os.path.join(load.repoPath, 'data', subDir)
+    if not os.path.isdir(searchDir):
+        return 0
+    return sum(
+        os.path.getsize(os.path.join(searchDir, n))
+            for n in os.listdir(searchDir)
+                if n.endswith('.csv') and not n[0] == '_'
+        )
+
+def balance(jobs, sizes, nWorkers):
+    # Longest-processing-time-first: biggest jobs go to the least loaded worker.
+    loads = [(0, rank) for rank in range(nWorkers)]
+    assignment = [[] for rank in range(nWorkers)]
+    for job in sorted(jobs, key = lambda j: sizes[j], reverse = True):
+        total, rank = heapq.heappop(loads)
+        assignment[rank].append(job)
+        heapq.heappush(loads, (total + sizes[job], rank))
+    return assignment
+
+def attach_boundaries(handles):
+    # Workers attach to the exported boundary sets rather than
+    # each holding (or re-reading) their own copy; any they cannot see
+    # are left to load.load_generic to read from disk as usual:
+    import sharedgeom
+    load.GENERIC.update({
+        aggType: sharedgeom.attach(handle)
+            for aggType, handle in handles.items()
+                if sharedgeom.visible(handle)
+        })
+
+def stage_report(records):
+    return {
+        name: dict(seconds = record['seconds'], changed = record['changed'])
+            for name, record in records.items()
+        }
+
+def run_job(job, force = False, options = None):
+    import pipeline
+    region, aggType = job
+    t0 = time.time()
+    stages = dict()
+    try:
+        # Stages whose inputs are unchanged since the last run are skipped:
+        stages = stage_report(
+            pipeline.make_mob_pipeline(region, aggType, **(options or {})).run(force = force)
+            )
+        status = 'done'
+    except (load.NoData, load.NoNewFiles):
+        status = 'nodata'
+    except Exception:
+        status = traceback.format_exc()
+    return dict(
+        region = region,
+        aggType = aggType,
+        status = status,
+        stages = stages,
+        seconds = time.time() - t0,
+        )
+
+def stale_jobs(jobs, options = None):
+    # Regions without tile data are never stale (run reports them as nodata):
+    import pipeline
+    return [
+        job for job in jobs
+            if load.has_tiles(job[0])
+                and any(pipeline.make_mob_pipeline(*job, **(options or {})).plan().values())
+        ]
+
+def run_mpi(comm, jobs, aggTypes, force = False, options = None):
+    # Ranks may sit on different nodes, so boundaries are shared
+    # through memory-mapped files rather than a shared memory block.
+    # Only the handles are broadcast, so this relies on resources/shared
+    # being on a filesystem every node can see; a rank that cannot see
+    # the files loads its own copy of the boundaries instead:
+    import sharedgeom
+    mmapDir = os.path.join(load.repoPath, 'resources', 'shared')
+    if comm.rank == 0:
+        shared = sharedgeom.export_generic(aggTypes, mmapDir = mmapDir)
+        handles = {aggType: s.handle for aggType, s in shared.items()}
+        sizes = {job: job_size(*job) for job in jobs}
+        assignment = balance(jobs, sizes, comm.size)
+    else:
+        handles, assignment = None, None
+    handles = comm.bcast(handles, root = 0)
+    assignment = comm.scatter(assignment, root = 0)
+    attach_boundaries(handles)
+    results = [run_job(job, force, options) for job in assignment]
+    results = comm.gather(results, root = 0)
+    if comm.rank == 0:
+        for s in shared.values():
+            s.close()
+            s.unlink()
+        return [result for sublist in results for result in sublist]
+    return None
+
+def run_pool(jobs, aggTypes, nWorkers = None, force = False, options = None):
+    import sharedgeom
+    shared = sharedgeom.export_generic(aggTypes)
+    handles = {aggType: s.handle for aggType, s in shared.items()}
+    sizes = {job: job_size(*job) for job in jobs}
+    ordered = sorted(jobs, key = lambda j: sizes[j], reverse = True)
+    try:
+        with ProcessPoolExecutor(
+                nWorkers,
+                initializer = attach_boundaries,
+                initargs = (handles,),
+                ) as executor:
+            futures = [executor.submit(run_job, job, force, options) for job in ordered]
+            return [future.result() for future in futures]
+    finally:
+        for s in shared.values():
+            s.close()
+            s.unlink()
+
+def run(regions, aggTypes, nWorkers = None, force = False, options = None):
+    # options are passed on to pipeline.make_mob_pipeline:
+    jobs = sorted(itertools.product(regions, aggTypes))
+    comm = get_comm()
+    # Jobs whose every stage is up to date never reach a worker:
+    if force:
+        todo = [job for job in jobs if load.has_tiles(job[0])]
+    elif comm is None:
+        todo = stale_jobs(jobs, options)
+    else:
+        todo = comm.bcast(stale_jobs(jobs, options) if comm.rank == 0 else None, root = 0)
+    aggTypes = sorted(set(aggType for region, aggType in todo))
+    if not len(todo):
+        results = []
+    elif comm is None:
+        results = run_pool(todo, aggTypes, nWorkers, force, options)
+    else:
+        results = run_mpi(comm, todo, aggTypes, force, options)
+    if results is not None:
+        results.extend(
+            dict(
+                region = region,
+                aggType = aggType,
+                status = 'unchanged' if load.has_tiles(region) else 'nodata',
+                stages = dict(),
+                seconds = 0.,
+                )
+                for region, aggType in jobs if not (region, aggType) in todo
+            )
+        for result in results:
+            if result['status'] == 'nodata':
+                print("No data currently available for:", result['region'])
+            elif not result['status'] in {'done', 'unchanged'}:
+                print("Something went wrong with:", result['region'], result['aggType'])
+                print(result['status'])
+    return results
+
+def run_dash_job(metros, force = False, shards = False):
+    # The dashboards of metros in one state, built in one process
+    # so that they share the state's frame (see analysis.make_dataFrm):
+    import pipeline
+    out = []
+    for metro in metros:
+        t0 = time.time()
+        stages = dict()
+        try:
+            stages = stage_report(
+                pipeline.make_dash_pipeline(shards, metro).run(force = force)
+                )
+            status = 'done'
+        except Exception:
+            status = traceback.format_exc()
+        out.append(dict(
+            metro = metro,
+            status = status,
+            stages = stages,
+            seconds = time.time() - t0,
+            ))
+    return out
+
+def run_dashes(metros, nWorkers = None, force = False, shards = False):
+    # One job per state, biggest first:
+    byState = dict()
+    for metro in sorted(metros):
+        byState.setdefault(load.METROSTATES[metro], []).append(metro)
+    jobs = sorted(
+        byState.values(),
+        key = lambda ms: job_size(load.METROSTATES[ms[0]]),
+        reverse = True,
+        )
+    if len(jobs) == 1:
+        results = run_dash_job(jobs[0], force, shards)
+    else:
+        with ProcessPoolExecutor(nWorkers) as executor:
+            futures = [executor.submit(run_dash_job, ms, force, shards) for ms in jobs]
+            results = [result for future in futures for result in future.result()]
+    for result in results:
+        if not result['status'] == 'done':
+            print("Something went wrong with the dashboard for:", result['metro'])
+            print(result['status'])
+    return results
@@ -0,0 +1,186 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+# A streaming GeoJSON writer for the maps, in place of GeoDataFrame.to_json,
+# which builds a Python dict for every feature and writes every coordinate
+# at full float precision.
+#
+# Properties are formatted a column at a time and coordinates a ring at a time
+# (rounded to a number of decimal places and handed to the C json encoder),
+# then written out feature by feature. The output is read by bokeh's
+# GeoJSONDataSource exactly as to_json's would be:
+# bokeh fills missing properties with NaN, ignores feature ids,
+# and draws only polygon exteriors, so none of these need be written.
+#
+# With delta, each ring is instead written as integers in units of
+# 10 ** -precision, the first point absolute and the rest as steps
+# from the point before, and the collection carries a TopoJSON-style
+# transform; such output must go through DELTA_JS before bokeh can read it.
+
+def property_tokens(series):
+    # JSON text for each value of a column, with None for nulls:
+    values = series.to_numpy()
+    if series.dtype.kind == 'f':
+        finite = np.isfinite(values)
+        return [repr(v) if ok else None for v, ok in zip(values.tolist(), finite)]
+    if series.dtype.kind in 'iu':
+        return [str(v) for v in values.tolist()]
+    if series.dtype.kind == 'b':
+        return ['true' if v else 'false' for v in values.tolist()]
+    if series.dtype.kind == 'M':
+        return [
+            None if pd.isnull(v) else json.dumps(v.isoformat())
+                for v in series
+            ]
+    return [
+        None if pd.api.types.is_scalar(v) and (pd.isnull(v) or v in (np.inf, -np.inf))
+            else json.dumps(v.item() if isinstance(v, np.generic) else v)
+                for v in values
+        ]
+
+def ring_text(ring, precision, delta):
+    ring = np.asarray(ring)[:, :2]
+    if delta:
+        q = np.round(ring * 10 ** precision).astype(np.int64)
+        q[1:] -= q[:-1].copy()
+        return json.dumps(q.tolist(), separators = (',', ':'))
+    return json.dumps(np.round(ring, precision).tolist(), separators = (',', ':'))
+
+def point_text(coords, precision, delta):
+    coords = np.asarray(coords, dtype = float)[:2]
+    if delta:
+        return json.dumps(
+            np.round(coords * 10 ** precision).astype(np.int64).tolist(),
+            separators = (',', ':'),
+            )
+    return json.dumps(np.round(coords, precision).tolist(), separators = (',', ':'))
+
+def polygon_text(geom, precision, delta, interiors):
+    rings = [geom.exterior]
+    if interiors:
+        rings.extend(geom.interiors)
+    return '[' + ','.join(ring_text(r.coords, precision, delta) for r in rings) + ']'
+
+def geometry_text(geom, precision = 6, delta = False, interiors = True):
+    if geom is None or geom.is_empty:
+        return 'null'
+    kind = geom.geom_type
+    if kind == 'Polygon':
+        coords = polygon_text(geom, precision, delta, interiors)
+    elif kind == 'MultiPolygon':
+        coords = '[' + ','.join(
+            polygon_text(g, precision, delta, interiors) for g in geom.geoms
+            ) + ']'
+    elif kind == 'LineString':
+        coords = ring_text(geom.coords, precision, delta)
+    elif kind == 'MultiLineString':
+        coords = '[' + ','.join(
+            ring_text(g.coords, precision, delta) for g in geom.geoms
+            ) + ']'
+    elif kind == 'Point':
+        coords = point_text(geom.coords[0], precision, delta)
+    elif kind == 'MultiPoint':
+        coords = '[' + ','.join(
+            point_text(g.coords[0], precision, delta) for g in geom.geoms
+            ) + ']'
+    else:
+        raise TypeError(kind)
+    return '{"type":"' + kind + '","coordinates":' + coords + '}'
+
+def write_features(
+        frm,
+        f,
+        precision = 6,
+        delta = False,
+        skipNulls = True,
+        interiors = True,
+        ):
+    # Streams frm (a GeoDataFrame; its index is not written)
+    # to the text file object f as a FeatureCollection.
+    # With skipNulls, null properties are left out of every feature
+    # but the first (so that bokeh still makes a column of them),
+    # and columns that are wholly null are left out altogether.
+    geomName = frm.geometry.name
+    keys = [key for key in frm.columns if not key == geomName]
+    tokens = {key: property_tokens(frm[key]) for key in keys}
+    if skipNulls:
+        keys = [key for key in keys if any(t is not None for t in tokens[key])]
+    heads = {key: json.dumps(str(key)) + ':' for key in keys}
+
+    f.write('{"type":"FeatureCollection",')
+    if delta:
+        scale = 10. ** -precision
+        f.write(
+            '"transform":{"scale":[' + repr(scale) + ',' + repr(scale) + '],'
+            + '"translate":[0,0]},'
+            )
+    f.write('"features":[')
+    for i, geom in enumerate(frm.geometry):
+        props = []
+        for key in keys:
+            token = tokens[key][i]
+            if token is None:
+                if skipNulls and i:
+                    continue
+                token = 'null'
+            props.append(heads[key] + token)
+        if i:
+            f.write(',')
+        f.write(
+            '{"type":"Feature","properties":{' + ','.join(props) + '},'
+            + '"geometry":' + geometry_text(geom, precision, delta, interiors) + '}'
+            )
+    f.write(']}')
+
+def to_geojson(frm, **kwargs):
+    f = io.StringIO()
+    write_features(frm, f, **kwargs)
+    return f.getvalue()
+
+def write_geojson(frm, filePath, **kwargs):
+    with utils.atomic_path(filePath) as tempPath:
+        with open(tempPath, 'w') as f:
+            write_features(frm, f, **kwargs)
+
+# Defines decode_geojson(text) -> GeoJSON text with absolute coordinates,
+# for collections written with delta:
+DELTA_JS = """
+    function decode_geojson(text) {
+        const collection = JSON.parse(text)
+        if (!collection.transform) {
+            return text
+            }
+        const [kx, ky] = collection.transform.scale
+        const [tx, ty] = collection.transform.translate
+        const point = p => [p[0] * kx + tx, p[1] * ky + ty]
+        const ring = r => {
+            let x = 0, y = 0
+            return r.map(p => {
+                x += p[0]
+                y += p[1]
+                return [x * kx + tx, y * ky + ty]
+                })
+            }
+        const decoders = {
+            Point: point,
+            MultiPoint: c => c.map(point),
+            LineString: ring,
+            MultiLineString: c => c.map(ring),
+            Polygon: c => c.map(ring),
+            MultiPolygon: c => c.map(p => p.map(ring)),
+            }
+        for (const feature of collection.features) {
+            const geom = feature.geometry
+            if (geom) {
+                geom.coordinates = decoders[geom.type](geom.coordinates)
+                }
+            }
+        delete collection.transform
+        return JSON.stringify(collection)
+        }
+"""
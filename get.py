@@ -26,14 +26,18 @@ def get_majority_area_lookup(fromFrm, toFrm, override = False, name = None, **kw
             return pickle.load(f)
     else:
         out = make_majority_area_lookup(fromFrm, toFrm)
-        with open(filePath, 'wb') as f:
-            pickle.dump(out, f)
+        with utils.atomic_path(filePath) as tempPath:
+            with open(tempPath, 'wb') as f:
+                pickle.dump(out, f)
         return out
 def make_majority_area_lookup(fromFrm, toFrm):
     import aggregate
     return aggregate.match_regions_by_majority_area(fromFrm, toFrm)
 
-def get_intersection_weights(fromFrm, toFrm, override = False, name = None, **kwargs):
+def get_intersection_weights(fromFrm, toFrm, override = False, name = None, sindex = None, **kwargs):
+    # A named cache (e.g. one per boundary set and zoom) accumulates
+    # the weights of every tile it is asked for, computing only those
+    # it has not seen; tiles that overlap no region are kept as empty lists.
     if name is None:
         name = '_'.join([
             utils.make_hash(str(pickle.dumps(frm)) + ':' + str(kwargs))
@@ -41,17 +45,23 @@ def get_intersection_weights(fromFrm, toFrm, override = False, name = None, **kw
             ])
     filename = '_'.join(['intersectionWeights', name]) + '.pkl'
     filePath = os.path.join(repoPath, 'resources', filename)
+    stored = dict()
     if os.path.isfile(filePath) and not override:
         with open(filePath, 'rb') as f:
-            return pickle.load(f)
-    else:
-        out = make_intersection_weights(fromFrm, toFrm)
-        with open(filePath, 'wb') as f:
-            pickle.dump(out, f)
-        return out
-def make_intersection_weights(fromFrm, toFrm):
-    joined = gpd.tools.sjoin(fromFrm, toFrm, 'left', 'intersects')
-    joined = joined.dropna()
+            stored = pickle.load(f)
+    missing = [key for key in fromFrm.index if not key in stored]
+    if missing:
+        out = make_intersection_weights(fromFrm.loc[missing], toFrm, sindex)
+        stored.update({key: out.get(key, []) for key in missing})
+        with utils.atomic_path(filePath) as tempPath:
+            with open(tempPath, 'wb') as f:
+                pickle.dump(stored, f)
+    return {key: stored[key] for key in fromFrm.index if stored[key]}
+def make_intersection_weights(fromFrm, toFrm, sindex = None):
+    if sindex is None:
+        import spindex
+        sindex = spindex.get_spatial_index(toFrm)
+    joined = sindex.query_join(fromFrm, toFrm, 'intersects')
     groupby = joined['index_right'].groupby(joined.index)
     def agg_func(s):
         nonlocal fromFrm
@@ -69,6 +79,62 @@ def make_intersection_weights(fromFrm, toFrm):
     weights = dict(zip(weights.index, list(weights)))
     return weights
 
+def get_population_weights(toFrm, zoom, source = 'raster', override = False, name = None):
+    if name is None:
+        name = utils.make_hash(str(pickle.dumps(toFrm)))
+    filename = '_'.join(['populationWeights', source, name, str(zoom)]) + '.pkl'
+    filePath = os.path.join(repoPath, 'resources', filename)
+    if os.path.isfile(filePath) and not override:
+        with open(filePath, 'rb') as f:
+            return pickle.load(f)
+    else:
+        out = make_population_weights(toFrm, zoom, source)
+        with utils.atomic_path(filePath) as tempPath:
+            with open(tempPath, 'wb') as f:
+                pickle.dump(out, f)
+        return out
+def make_population_weights(toFrm, zoom, source = 'raster'):
+    # Weights each tile's share of each region by resident population
+    # rather than area; tiles nobody lives in are absent from the output.
+    import load
+    if source == 'raster':
+        points = load.load_aus_pop()
+    elif source == 'mb':
+        points = load.load_mb_pop()
+    else:
+        raise ValueError(source)
+    points = points.loc[points['pop'] > 0.][['pop', 'geometry']]
+    # Tiles are found from longitudes and latitudes, taken before
+    # the points are reprojected to match the regions:
+    lonlats = points.geometry if points.crs is None else points.geometry.to_crs(epsg = 4326)
+    points = points.assign(lon = lonlats.x.values, lat = lonlats.y.values)
+    if not (toFrm.crs is None or points.crs is None):
+        points = points.to_crs(toFrm.crs)
+    joined = gpd.tools.sjoin(points, toFrm[['geometry']], 'inner', 'within')
+    # Bin populations by (tile, region) pair:
+    xs, ys = utils.lonlats_to_tiles(joined['lon'], joined['lat'], zoom)
+    tileCodes, tiles = pd.factorize(xs * 2 ** zoom + ys)
+    regionCodes, regions = pd.factorize(joined['index_right'])
+    nRegions = len(regions)
+    pairCodes, pairs = pd.factorize(tileCodes * nRegions + regionCodes)
+    pairPops = np.bincount(pairCodes, weights = joined['pop'].values)
+    pairTiles, pairRegions = pairs // nRegions, pairs % nRegions
+    tilePops = np.bincount(pairTiles, weights = pairPops, minlength = len(tiles))
+    pairWeights = pairPops / tilePops[pairTiles]
+    # Unpack into the same form as the area weights:
+    quadkeys = utils.tiles_to_quadkeys(tiles // 2 ** zoom, tiles % 2 ** zoom, zoom)
+    order = np.argsort(pairTiles, kind = 'stable')
+    splits = np.cumsum(np.bincount(pairTiles, minlength = len(tiles)))[:-1]
+    regions = np.asarray(regions)
+    weights = dict()
+    for quadkey, tileRegions, tileWeights in zip(
+            quadkeys,
+            np.split(pairRegions[order], splits),
+            np.split(pairWeights[order], splits),
+            ):
+        weights[quadkey] = list(zip(regions[tileRegions].tolist(), tileWeights.tolist()))
+    return weights
+
 def get_quadFrm(quadkeys):
     quadkeys = sorted(set(quadkeys))
     quadpolys = utils.quadkeys_to_polys(quadkeys)
@@ -86,8 +152,9 @@ def get_poly_quadkeys(poly, zoom, override = False, name = None, **kwargs):
             return pickle.load(f)
     else:
         out = make_poly_quadkey(poly, zoom, **kwargs)
-        with open(filePath, 'wb') as f:
-            pickle.dump(out, f)
+        with utils.atomic_path(filePath) as tempPath:
+            with open(tempPath, 'wb') as f:
+                pickle.dump(out, f)
         return out
 def make_poly_quadkey(poly, zoom, **kwargs):
     return utils.find_quadkeys(poly, zoom, **kwargs)
@@ -112,8 +179,9 @@ def get_frm_poly(frm, override = False, name = None, **kwargs):
             return pickle.load(f)
     else:
         out = make_frm_poly(frm, **kwargs)
-        with open(filePath, 'wb') as f:
-            pickle.dump(out, f)
+        with utils.atomic_path(filePath) as tempPath:
+            with open(tempPath, 'wb') as f:
+                pickle.dump(out, f)
         return out
 def make_frm_poly(frm, convex = False, simple = False):
     if convex:
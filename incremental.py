@@ -0,0 +1,192 @@
+import os
+import pickle
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+repoPath = os.path.abspath(os.path.dirname(__file__))
+stateDir = os.path.join(repoPath, 'resources', 'state')
+
+# Derived metrics over (day x series) arrays, kept up to date a day at a time
+# rather than recomputed over the whole history, with their states
+# pickled between builds under resources/state.
+#
+# Running totals and trailing means:
+# Totals are running sums down each column and the trailing mean of a day
+# is the difference of the totals a window apart, so the rows for new days
+# need only the totals of the window of days before them.
+# The state records a digest of each day's inputs; when a day already seen
+# changes (e.g. late-reported cases) everything from that day on is redone,
+# and anything else (new series, a different window) starts afresh.
+# Because every row goes through the same operations in the same order
+# either way, the results are identical to a full recompute.
+
+def rolling_totals(values, window = 7, before = None, offset = 0):
+    # Running totals and trailing window means down the columns of values,
+    # whose first row is day offset of the history; before holds
+    # the totals of the (up to) window days preceding it.
+    values = np.asarray(values, dtype = float)
+    nDays, nSeries = values.shape
+    if before is None:
+        before = np.zeros((0, nSeries))
+    first = before[-1] if len(before) else np.zeros(nSeries)
+    cumulative = np.cumsum(np.vstack([first[None], values]), axis = 0)[1:]
+    # History of totals from day `start`, with a zero day before the first:
+    if offset - len(before) == 0:
+        history = np.vstack([np.zeros((1, nSeries)), before, cumulative])
+        start = -1
+    else:
+        history = np.vstack([before, cumulative])
+        start = offset - len(before)
+    rolling = np.full((nDays, nSeries), np.nan)
+    lo, hi = max(offset, window - 1), offset + nDays
+    if hi > lo:
+        rolling[lo - offset :] = (
+            history[lo - start : hi - start] - history[lo - window - start : hi - window - start]
+            ) / window
+    return cumulative, rolling
+
+def row_digests(values):
+    return [hashlib.sha1(row.tobytes()).digest() for row in np.ascontiguousarray(values)]
+
+class DailyState:
+
+    # Common to the states below: the days and series seen so far,
+    # with a digest of each day's inputs.
+
+    def __init__(self):
+        self.days = pd.DatetimeIndex([])
+        self.names = []
+        self.digests = []
+
+    def unchanged(self, days, names, values):
+        # How many leading days of (days x names) values are as last seen:
+        digests = row_digests(values)
+        k = 0
+        sameHistory = (
+            list(names) == list(self.names)
+                and len(self.days)
+                and days[0] == self.days[0]
+                and pd.Index(days[: len(self.days)]).equals(self.days[: len(days)])
+            )
+        if sameHistory:
+            for old, new in zip(self.digests, digests):
+                if not old == new:
+                    break
+                k += 1
+        return k, digests
+
+class RollingState(DailyState):
+
+    def __init__(self, window = 7):
+        super().__init__()
+        self.window = window
+        self.cumulative = None
+        self.rolling = None
+
+    def matches(self, other):
+        return self.window == other.window
+
+    def update(self, days, names, values):
+        # Brings the state up to (days x names) values,
+        # returning the running totals and trailing means for all of it:
+        days = pd.DatetimeIndex(days)
+        values = np.asarray(values, dtype = float)
+        k, digests = self.unchanged(days, names, values)
+        if k == len(days) == len(self.days):
+            return self.cumulative, self.rolling
+        if k:
+            before = self.cumulative[max(0, k - self.window) : k]
+            cumulative, rolling = rolling_totals(values[k:], self.window, before, k)
+            cumulative = np.vstack([self.cumulative[:k], cumulative])
+            rolling = np.vstack([self.rolling[:k], rolling])
+        else:
+            cumulative, rolling = rolling_totals(values, self.window)
+        print("Updated rolling state from day", k, "of", len(days))
+        self.days, self.names, self.digests = days, list(names), digests
+        self.cumulative, self.rolling = cumulative, rolling
+        return cumulative, rolling
+
+class WeekdayExtremes(DailyState):
+
+    # The n highest and n lowest values of each series on each day of the week,
+    # and the scores they give (as analysis.day_score_matrix: each value
+    # normalised between the means of its series' weekday extremes).
+    # New days are merged into the extremes, and the earlier scores
+    # of a series are only redone for the weekdays where its extremes moved.
+    # The extremes of a day cannot be taken back out, so a change
+    # to any day already seen starts the state afresh.
+
+    def __init__(self, n = 4):
+        super().__init__()
+        self.n = n
+        self.highs = None
+        self.lows = None
+        self.scores = None
+
+    def matches(self, other):
+        return self.n == other.n
+
+    def update(self, days, names, values):
+        # Brings the state up to (days x names) values,
+        # returning the scores for all of it:
+        from analysis import extremes, finite_mean
+        days = pd.DatetimeIndex(days)
+        values = np.asarray(values, dtype = float)
+        k, digests = self.unchanged(days, names, values)
+        if k == len(days) == len(self.days):
+            return self.scores
+        if k < len(self.days):
+            k = 0
+        nNames = values.shape[1]
+        if not k:
+            self.highs = np.full((7, nNames, self.n), np.nan)
+            self.lows = np.full((7, nNames, self.n), np.nan)
+            self.scores = np.zeros((0, nNames))
+        scores = np.vstack([self.scores[:k], np.full((len(days) - k, nNames), np.nan)])
+        weekdays = days.dayofweek.to_numpy()
+        for day in np.unique(weekdays[k:]):
+            oldRows = np.flatnonzero(weekdays[:k] == day)
+            newRows = k + np.flatnonzero(weekdays[k:] == day)
+            oldHighs, oldLows = finite_mean(self.highs[day]), finite_mean(self.lows[day])
+            highs, _ = extremes(np.hstack([self.highs[day], values[newRows].T]), self.n)
+            _, lows = extremes(np.hstack([self.lows[day], values[newRows].T]), self.n)
+            self.highs[day], self.lows[day] = highs, lows
+            highs, lows = finite_mean(highs), finite_mean(lows)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                moved = ~(
+                    ((highs == oldHighs) | (np.isnan(highs) & np.isnan(oldHighs)))
+                        & ((lows == oldLows) | (np.isnan(lows) & np.isnan(oldLows)))
+                    )
+                if len(oldRows) and moved.any():
+                    rows = np.ix_(oldRows, np.flatnonzero(moved))
+                    scores[rows] = (values[rows] - lows[moved]) / (highs - lows)[moved]
+                scores[newRows] = (values[newRows] - lows) / (highs - lows)
+        print("Updated weekday extremes from day", k, "of", len(days))
+        self.days, self.names, self.digests = days, list(names), digests
+        self.scores = scores
+        return scores
+
+def state_path(name):
+    return os.path.join(stateDir, 'state_' + name + '.pkl')
+
+def load_state(name, fresh):
+    # The stored state of the given name, or fresh if there is none
+    # (or if it was kept with other settings):
+    path = state_path(name)
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if type(state) is type(fresh) and state.matches(fresh):
+            return state
+    return fresh
+
+def save_state(name, state):
+    if not os.path.isdir(stateDir):
+        os.makedirs(stateDir)
+    with utils.atomic_path(state_path(name)) as tempPath:
+        with open(tempPath, 'wb') as f:
+            pickle.dump(state, f)
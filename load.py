@@ -134,6 +134,11 @@ FBURLS['aus']['pop']['regs'] = '2848131948635964'
 FBURLS['aus']['mob']['tiles'] = '3013895718671644'
 FBURLS['aus']['mob']['regs'] = '156664265628571'
 
+def has_tiles(region, dataset = 'mob'):
+    # Whether Facebook publishes tile-level data for the region:
+    return FBURLS.get(region, dict()).get(dataset, dict()).get('tiles') is not None
+
+
 def quick_pull_data(state, dataset, aggregation):
     from fbapi.code import pull_datas
     rootURL = "https://www.facebook.com/geoinsights-portal/downloads"
@@ -181,9 +186,35 @@ STATENAMES = {
 
 GCCNAMES = {
     'mel': 'Greater Melbourne',
-    'syd': 'Greater Sydney'
+    'syd': 'Greater Sydney',
+    'bri': 'Greater Brisbane',
+    'ade': 'Greater Adelaide',
+    'per': 'Greater Perth',
+    'hob': 'Greater Hobart',
+    'dar': 'Greater Darwin',
+    'can': 'Australian Capital Territory',
+    }
+
+# The state (or territory) around each capital:
+METROSTATES = {
+    'mel': 'vic',
+    'syd': 'nsw',
+    'bri': 'qld',
+    'ade': 'sa',
+    'per': 'wa',
+    'hob': 'tas',
+    'dar': 'nt',
+    'can': 'act',
     }
 
+# Regions with tile-level mobility data, and the capitals whose
+# dashboards can be built (which need it for both capital and state):
+TILEREGIONS = sorted(region for region in FBURLS if has_tiles(region))
+TILEMETROS = sorted(
+    metro for metro, state in METROSTATES.items()
+        if has_tiles(metro) and has_tiles(state)
+    )
+
 def get_fb_pop_tiles(state):
     quick_pull_data(state, 'pop', 'tiles')
     return load_fb_pop_tiles(state)
@@ -262,7 +293,7 @@ def load_fb_mob_tiles_wa():
 def load_fb_mob_tiles_tas():
     return load_fb_mob_tiles('tas')
 
-def load_fb_tiles(region, dataset, get = False, override = True):
+def load_fb_tiles(region, dataset, get = False, override = True, since = None):
     global FBURLS
 #     if get:
 #         quick_pull_data(region, dataset, 'tiles')
@@ -271,6 +302,8 @@ def load_fb_tiles(region, dataset, get = False, override = True):
     searchDir = os.path.join(dataDir, subDir)
     if not os.path.isdir(searchDir):
         os.mkdir(searchDir, mode = 777)
+    if not since is None:
+        return load_fb_tiles_since(region, dataset, searchDir, since)
     out = new_load_fb_tiles(region, dataset)
 #     pre, ignoreKeys = None, set()
 #     if not override:
@@ -292,6 +325,22 @@ def load_fb_tiles(region, dataset, get = False, override = True):
     out.to_csv(allFilePath)
     return out
 
+def load_fb_tiles_since(region, dataset, searchDir, since):
+    # Skips snapshot files from well before the requested local date
+    # (filenames are UTC, hence the day of slack), then trims exactly:
+    since = pd.Timestamp(since).date()
+    cutoff = str((pd.Timestamp(since) - pd.Timedelta(days = 1)).date())
+    ignoreKeys = set([
+        n[:-4] for n in os.listdir(searchDir)
+            if n.endswith('.csv') and n[:10] < cutoff
+        ])
+    out = new_load_fb_tiles(region, dataset, ignoreKeys)
+    dates = out.index.get_level_values('datetime').date
+    out = out.loc[dates >= since]
+    if not len(out):
+        raise NoNewFiles
+    return out
+
 def pre_load_fb_tiles(region, dataset):
     global FBURLS
     dataDir = os.path.join(repoPath, 'data')
@@ -382,7 +431,16 @@ def new_load_fb_tiles(region, dataset, ignoreKeys = set()):
     print("Done.")
     return frm
 
+# Boundary frames placed here (e.g. by a parallel driver)
+# are served by load_generic instead of being re-read from disk:
+GENERIC = dict()
+
 def load_generic(option, **kwargs):
+    if option in GENERIC and not len(kwargs):
+        source = GENERIC[option]
+        if hasattr(source, 'load_frame'):
+            return source.load_frame()
+        return source.copy()
     optionsDict = {
         'lga': load_lgas,
         'sa2': lambda: load_SA(2),
@@ -390,6 +448,20 @@ def load_generic(option, **kwargs):
         }
     return optionsDict[option](**kwargs)
 
+# The files each boundary set of load_generic is read from:
+GENERICFILES = dict(
+    lga = ['LGA_2019_AUST'],
+    sa2 = ['SA2_2016_AUST'],
+    postcodes = ['POA_2016_AUST', 'STE_2016_AUST'],
+    )
+
+def generic_paths(option):
+    return [
+        os.path.join(repoPath, 'resources', name + ext)
+            for name in GENERICFILES[option]
+                for ext in ['.shp', '.dbf']
+        ]
+
 def load_lgas():
     paths = [repoPath, 'resources', 'LGA_2019_AUST.shp']
     lgas = gpd.read_file(os.path.join(*paths))
@@ -494,6 +566,23 @@ def load_mb_all():
     states = {'vic', 'nsw', 'qld', 'nt', 'sa', 'act', 'wa', 'tas'}
     return pd.concat([load_mb(state) for state in states])
 
+def load_mb_pop():
+    # Mesh block centroids carrying census usual-resident counts:
+    filePath = os.path.join(repoPath, 'resources', 'mb_counts_16.csv')
+    counts = pd.read_csv(filePath, usecols = ['MB_CODE_2016', 'Person'])
+    counts = counts.rename(dict(MB_CODE_2016 = 'MB_CODE16', Person = 'pop'), axis = 1)
+    counts = counts.set_index('MB_CODE16')['pop']
+    mbs = load_mb_all()
+    mbs = mbs.loc[mbs.index.isin(counts.index)]
+    frm = gdf(
+        counts.loc[mbs.index].values,
+        columns = ['pop'],
+        index = mbs.index,
+        crs = mbs.crs,
+        geometry = mbs['geometry'].representative_point().values,
+        )
+    return frm
+
 def load_lga_pop():
     filePath = os.path.join(repoPath, 'resources', 'LGA ERP GeoPackage 2018.gpkg')
     return gdf.from_file(filePath)
@@ -0,0 +1,114 @@
+import os
+
+import pandas as pd
+
+import load
+import aggregate
+
+def partition_by_date(frm, chunkSize = 7, datetimeKey = 'datetime'):
+    # Splits a tiles frame into chunks of whole local days,
+    # so that aggregate_by_date can be run on each chunk independently:
+    dates = pd.Index(frm.index.get_level_values(datetimeKey).date)
+    uniqueDates = sorted(set(dates))
+    for i in range(0, len(uniqueDates), chunkSize):
+        chunkDates = uniqueDates[i : i + chunkSize]
+        yield frm.loc[dates.isin(chunkDates)]
+
+def prepare_shared(frm, aggType = 'lga', weightType = 'area', bounds = None):
+    # Everything the chunks must agree on is computed once up front
+    # from the full frame, exactly as the serial path would:
+    absFrm = load.load_generic(aggType)
+    quadkeys = [
+        *frm.index.get_level_values('quadkey'),
+        *frm.index.get_level_values('end_key'),
+        ]
+    if bounds is None:
+        bounds = aggregate.get_tile_bounds(quadkeys)
+    toFrm = absFrm.loc[absFrm.intersects(bounds)]
+    popWeights = None
+    if weightType == 'pop':
+        from get import get_population_weights
+        zoom = len(quadkeys[0])
+        popWeights = get_population_weights(absFrm, zoom, name = aggType)
+    import spindex
+    sindex = spindex.get_generic_index(aggType)
+    weights = aggregate.get_tile_weights(
+        quadkeys, toFrm, weightType, popWeights, sindex, spindex.generic_name(aggType)
+        )
+    return absFrm, weights, bounds
+
+def aggregate_chunk(chunk, clip, aggType, absFrm, weights, bounds):
+    agg = aggregate.aggregate_mob_tiles_to_abs(
+        chunk,
+        clip,
+        aggType,
+        absFrm = absFrm,
+        weights = weights,
+        bounds = bounds,
+        )
+    return aggregate.aggregate_by_date(agg)
+
+def aggregate_mob_tiles_dask(
+        frm,
+        clip = None,
+        aggType = 'lga',
+        weightType = 'area',
+        nWorkers = None,
+        chunkSize = 7,
+        scheduler = 'distributed',
+        bounds = None,
+        ):
+
+    if nWorkers is None:
+        nWorkers = os.cpu_count()
+
+    absFrm, weights, bounds = prepare_shared(frm, aggType, weightType, bounds)
+    chunks = list(partition_by_date(frm, chunkSize))
+
+    print(f"Aggregating {len(chunks)} chunks on {nWorkers} workers...")
+
+    if scheduler == 'distributed':
+        from dask.distributed import Client, LocalCluster
+        with LocalCluster(
+                    n_workers = nWorkers,
+                    threads_per_worker = 1,
+                    processes = True,
+                    ) as cluster, \
+                Client(cluster) as client:
+            # Ship the boundaries and weights to each worker only once:
+            absFut, weightsFut = client.scatter([absFrm, weights], broadcast = True)
+            chunkFuts = client.scatter(chunks)
+            futures = [
+                client.submit(
+                    aggregate_chunk,
+                    chunkFut, clip, aggType, absFut, weightsFut, bounds,
+                    )
+                    for chunkFut in chunkFuts
+                ]
+            outs = client.gather(futures)
+    else:
+        from dask import delayed, compute
+        tasks = [
+            delayed(aggregate_chunk)(chunk, clip, aggType, absFrm, weights, bounds)
+                for chunk in chunks
+            ]
+        outs = compute(*tasks, scheduler = scheduler, num_workers = nWorkers)
+
+    out = pd.concat(outs)
+    out = out.sort_index()
+
+    print("Aggregated.")
+
+    return out
+
+def frames_match(frm1, frm2, **kwargs):
+    # Row order within duplicate index entries is not meaningful,
+    # so both frames are put in a canonical order before comparing:
+    canon = lambda f: f.reset_index().sort_values(
+        list(f.index.names) + list(f.columns)
+        ).reset_index(drop = True)
+    try:
+        pd.testing.assert_frame_equal(canon(frm1), canon(frm2), **kwargs)
+        return True
+    except AssertionError:
+        return False
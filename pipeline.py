@@ -0,0 +1,428 @@
+import os
+import time
+import pickle
+import hashlib
+import inspect
+
+import load
+import utils
+
+repoPath = os.path.abspath(os.path.dirname(__file__))
+pipelineDir = os.path.join(repoPath, 'resources', 'pipeline')
+
+# A build is a chain of named stages. Each stage's fingerprint combines
+# its own parameters, a description of any files it reads directly,
+# the source of its function (and of any modules or functions
+# it leans on), and the content hashes of its upstream outputs;
+# the stage output is pickled after a record of that fingerprint,
+# so a stage whose fingerprint is unchanged is skipped and its stored output reused.
+# Because upstream outputs enter by content, a rebuilt stage that produces
+# the same output as before does not force anything downstream to rebuild.
+
+def file_listing(*paths):
+    # Cheap fingerprint of files and directories of files:
+    # names, sizes and modification times rather than contents.
+    out = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.startswith('.') or name.startswith('_'):
+                    continue
+                stat = os.stat(os.path.join(path, name))
+                out.append((name, stat.st_size, int(stat.st_mtime)))
+        elif os.path.isfile(path):
+            stat = os.stat(path)
+            out.append((os.path.basename(path), stat.st_size, int(stat.st_mtime)))
+        else:
+            out.append((os.path.basename(path), None, None))
+    return out
+
+def content_hash(obj = None, paths = ()):
+    hasher = hashlib.sha256()
+    if obj is not None:
+        hasher.update(pickle.dumps(obj, protocol = 4))
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(block)
+    return hasher.hexdigest()
+
+def func_source(func):
+    # The source of a function (or of a whole module):
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return getattr(func, '__qualname__', repr(func))
+
+def sources_hash(sources):
+    return utils.make_hash([func_source(source) for source in sources])
+
+class Stage:
+
+    def __init__(
+            self,
+            name,
+            func,
+            upstream = (),
+            params = None,
+            inputs = None,
+            outputs = None,
+            store = True,
+            volatile = False,
+            sources = (),
+            reader = None,
+            ):
+        # func is called with the upstream outputs in order, then params;
+        # inputs and outputs are callables returning lists of file paths;
+        # sources are the modules and functions doing func's real work,
+        # whose source enters the fingerprint beside func's own;
+        # stages with store = False (e.g. ones that only write products)
+        # keep a record of their fingerprint rather than their output,
+        # which reader (if given) reads back from the outputs when needed;
+        # volatile stages (e.g. ones reading remote data) always rerun,
+        # leaving it to their content hash to spare the stages downstream.
+        self.name = name
+        self.func = func
+        self.upstream = tuple(upstream)
+        self.params = dict() if params is None else params
+        self.inputs = inputs
+        self.outputs = outputs
+        self.store = store
+        self.volatile = volatile
+        self.sources = tuple(sources)
+        self.reader = reader
+
+    def __repr__(self):
+        return 'Stage(' + self.name + ')'
+
+class Pipeline:
+
+    def __init__(self, name, stages, artifactDir = None):
+        self.name = name
+        self.stages = {stage.name: stage for stage in stages}
+        self.artifactDir = pipelineDir if artifactDir is None else artifactDir
+        self._fingerprints = dict()
+        self._records = dict()
+        self._values = dict()
+
+    def record(self, stageName):
+        # The leading record of a stage artifact (without its output):
+        if not stageName in self._records:
+            path = self.artifact_path(stageName)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    self._records[stageName] = pickle.load(f)
+            else:
+                self._records[stageName] = None
+        return self._records[stageName]
+
+    def upstream_content(self, stageName):
+        # Unknown (None) if the upstream stage is itself due a rebuild:
+        if not self.is_fresh(stageName):
+            return None
+        return self.record(stageName)['content']
+
+    def fingerprint(self, stageName):
+        if stageName in self._fingerprints:
+            return self._fingerprints[stageName]
+        stage = self.stages[stageName]
+        parts = [
+            stage.name,
+            sorted(stage.params.items()),
+            func_source(stage.func),
+            [self.upstream_content(name) for name in stage.upstream],
+            sources_hash(stage.sources),
+            ]
+        if stage.inputs is not None:
+            parts.append(file_listing(*stage.inputs()))
+        if None in parts[3]:
+            out = None
+        else:
+            out = utils.make_hash(parts)
+        self._fingerprints[stageName] = out
+        return out
+
+    def artifact_path(self, stageName):
+        filename = '_'.join([self.name, stageName]) + '.pkl'
+        return os.path.join(self.artifactDir, filename)
+
+    def load_artifact(self, stageName):
+        with open(self.artifact_path(stageName), 'rb') as f:
+            record = pickle.load(f)
+            return record, pickle.load(f)
+
+    def is_fresh(self, stageName):
+        stage = self.stages[stageName]
+        if stage.volatile:
+            return stageName in self._values
+        record = self.record(stageName)
+        if record is None:
+            return False
+        fingerprint = self.fingerprint(stageName)
+        if fingerprint is None or not record['fingerprint'] == fingerprint:
+            return False
+        if stage.outputs is not None:
+            if not all(os.path.isfile(p) for p in stage.outputs()):
+                return False
+        return True
+
+    def order(self, targets = None):
+        # Stages needed for targets, upstream first:
+        if targets is None:
+            targets = list(self.stages)
+        out = []
+        def visit(name):
+            if name in out:
+                return
+            for upName in self.stages[name].upstream:
+                visit(upName)
+            out.append(name)
+        for name in targets:
+            visit(name)
+        return out
+
+    def plan(self, targets = None):
+        # Which stages would be rebuilt; stages downstream of a stale stage
+        # are counted as stale, though at run time they are skipped
+        # if the rebuilt stage turns out to produce the same output.
+        return {name: not self.is_fresh(name) for name in self.order(targets)}
+
+    def dry_run(self, targets = None):
+        plan = self.plan(targets)
+        for name, stale in plan.items():
+            print(('rebuild' if stale else 'skip') + ':', self.name, name)
+        return plan
+
+    def value(self, stageName):
+        # Output of a stage, computing it only if it is stale
+        # and reading it back from its artifact otherwise:
+        if stageName in self._values:
+            return self._values[stageName]
+        stage = self.stages[stageName]
+        if self.is_fresh(stageName) and stage.store:
+            record, out = self.load_artifact(stageName)
+        elif self.is_fresh(stageName) and stage.reader is not None:
+            out = stage.reader()
+        else:
+            out = self.build(stageName)
+        self._values[stageName] = out
+        return out
+
+    def build(self, stageName):
+        stage = self.stages[stageName]
+        args = [self.value(name) for name in stage.upstream]
+        print("Building stage:", self.name, stageName)
+        t0 = time.time()
+        out = stage.func(*args, **stage.params)
+        seconds = time.time() - t0
+        if stage.store:
+            content = content_hash(out)
+        else:
+            content = content_hash(paths = stage.outputs() if stage.outputs else ())
+        previous = self.record(stageName)
+        # Fingerprinted as of after the build, which may have written its inputs:
+        self._fingerprints.pop(stageName, None)
+        record = dict(
+            fingerprint = self.fingerprint(stageName),
+            content = content,
+            changed = previous is None or not previous['content'] == content,
+            seconds = seconds,
+            )
+        if not os.path.isdir(self.artifactDir):
+            os.makedirs(self.artifactDir)
+        with utils.atomic_path(self.artifact_path(stageName)) as tempPath:
+            with open(tempPath, 'wb') as f:
+                pickle.dump(record, f)
+                pickle.dump(out if stage.store else None, f)
+        self._records[stageName] = record
+        self._values[stageName] = out
+        # Downstream fingerprints now see this stage's new content:
+        self._fingerprints.clear()
+        return out
+
+    def run(self, targets = None, force = False):
+        # Brings every stage needed for targets up to date,
+        # returning a record (timing, whether the output changed)
+        # for each stage that was rebuilt:
+        out = dict()
+        for name in self.order(targets):
+            if self.is_fresh(name) and not force:
+                continue
+            self.build(name)
+            out[name] = self.record(name)
+        return out
+
+def tiles_dir(region, dataset = 'mob'):
+    subDir = load.FBURLS[region][dataset]['tiles']
+    if subDir is None:
+        raise load.NoData("No tile data for region: " + region)
+    return os.path.join(repoPath, 'data', subDir)
+
+def mob_date_sources():
+    # What turns tiles into the date product:
+    import get
+    import utils
+    import spindex
+    import aggregate
+    import produce
+    return [
+        load,
+        get,
+        utils,
+        spindex,
+        aggregate,
+        produce.get_mob_date,
+        produce.update_mob_counts,
+        produce.make_mob_counts,
+        produce.derive_mob_counts,
+        produce.weight_mob_date,
+        ]
+
+def make_mob_pipeline(region, aggType = 'lga', weightType = 'area', light = False, shards = False):
+
+    import produce
+    import pyramid
+    import encode
+    import geowrite
+
+    # Stage functions are kept at module level below so that
+    # their source (and so the fingerprints) only change with the code.
+    productPath = lambda ext: os.path.join(
+        produce.dataDir, '_'.join(['mob', aggType, region]) + ext
+        )
+    statsPath = os.path.join(
+        produce.resourcesDir, '_'.join(['mobStats', aggType, region]) + '.pkl'
+        )
+
+    # The date product is brought up to date a day at a time
+    # (see produce.get_mob_date), so new tiles only cost their own days;
+    # a change to the code or the boundaries behind it (its version)
+    # rebuilds it from scratch instead.
+    dateSources = mob_date_sources()
+    version = utils.make_hash([
+        weightType,
+        sources_hash(dateSources),
+        file_listing(*load.generic_paths(aggType)),
+        ])
+
+    stages = [
+        Stage(
+            'date',
+            write_mob_date,
+            params = dict(
+                region = region,
+                aggType = aggType,
+                weightType = weightType,
+                version = version,
+                ),
+            inputs = lambda: [
+                tiles_dir(region),
+                *load.generic_paths(aggType),
+                ],
+            outputs = lambda: [productPath('.csv'), statsPath],
+            sources = dateSources,
+            store = False,
+            reader = lambda: produce.load_mob_date(productPath('.csv')),
+            ),
+        Stage(
+            'plots',
+            produce.make_mob_plots,
+            upstream = ['date'],
+            params = dict(region = region, aggType = aggType),
+            outputs = lambda: [productPath('.png')],
+            store = False,
+            ),
+        Stage(
+            'dateMap',
+            produce.make_mob_dateMap,
+            upstream = ['date'],
+            params = dict(region = region, aggType = aggType, light = light, shards = shards),
+            inputs = lambda: [*load.generic_paths(aggType)],
+            outputs = lambda: [productPath('.html')] + (
+                [productPath(os.path.join('_shards', 'index.json'))] if light and shards else []
+                ),
+            sources = [
+                produce.make_mob_dateMap_light,
+                produce.make_dateMap_light,
+                pyramid,
+                encode,
+                ] if light else [
+                produce.make_mob_dateMap_frame,
+                produce.make_dateMap,
+                pyramid,
+                geowrite,
+                ],
+            store = False,
+            ),
+        ]
+
+    return Pipeline('_'.join(['mob', aggType, region]), stages)
+
+def write_mob_date(region, aggType, weightType, version):
+    # Writes the date csv (and the stats later updates need),
+    # adding only new days to what is there when its version still holds:
+    import produce
+    return produce.get_mob_date(
+        region,
+        aggType,
+        refresh = True,
+        incremental = True,
+        version = version,
+        weightType = weightType,
+        )
+
+def make_dash_pipeline(shards = False, metro = 'mel'):
+
+    import produce
+
+    name = metro + 'dash'
+    productPath = lambda filename: os.path.join(produce.dataDir, filename)
+
+    stages = [
+        Stage(
+            'frame',
+            produce.make_dash_frame,
+            params = dict(metro = metro),
+            outputs = lambda: [productPath(name + '.csv')],
+            # Case numbers are fetched afresh each time:
+            volatile = True,
+            ),
+        Stage(
+            'dash',
+            build_dash,
+            upstream = ['frame'],
+            params = dict(metro = metro, shards = shards),
+            outputs = lambda: [productPath(name + '.html')] + (
+                [productPath(os.path.join(name + '_shards', 'index.json'))] if shards else []
+                ),
+            store = False,
+            ),
+        ]
+    if metro == 'mel':
+        stages.append(
+            Stage(
+                'summary',
+                build_melsummary,
+                upstream = ['frame'],
+                outputs = lambda: [
+                    productPath(filename) for filename in [
+                        'melsummary.html',
+                        'melsummaryse.png',
+                        'melsummaryse_hires.png',
+                        'melsummarysimple.png',
+                        ]
+                    ],
+                store = False,
+                )
+            )
+
+    return Pipeline(name, stages)
+
+def build_dash(frm, metro = 'mel', shards = False):
+    import produce
+    produce.make_dash(metro, frm, shards = shards)
+
+def build_melsummary(frm):
+    # Reads the frame back from the meldash csv product:
+    import produce
+    produce.update_melsummary()
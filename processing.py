@@ -25,14 +25,6 @@ def frm_to_lgaFrm(frm, key = 'LGA'):
     frm = gdf(frm)
     return frm
 
-def clip_frm(frm, poly, op = 'within', buffer = 1e-3, **kwargs):
-    if type(poly) is gdf:
-        poly = unify_frm(poly, **kwargs)
-    if not buffer is None:
-        poly = poly.buffer(np.sqrt(poly.area) * buffer)
-    func = getattr(frm['geometry'], op)
-    return frm.loc[func(poly)]
-
 def clip_to_gcc(frm, gcc, convex = True, **kwargs):
     poly = load.load_gccs().loc[gcc]['geometry']
     if convex:
@@ -44,13 +36,19 @@ def unify_frm(frm, convex = True):
         frm = frm.convex_hull
     poly = shapely.ops.unary_union(frm)
     return poly
-def clip_frm(frm, poly, op = 'within', buffer = 1e-3, **kwargs):
+def clip_frm(frm, poly, op = 'within', buffer = 1e-3, sindex = None, **kwargs):
     if type(poly) is gdf:
         poly = unify_frm(poly, **kwargs)
     if not buffer is None:
         poly = poly.buffer(np.sqrt(poly.area) * buffer)
-    func = getattr(frm['geometry'], op)
-    return frm.loc[func(poly)]
+    # Only rows whose boxes meet the clip polygon need the exact test:
+    if sindex is None:
+        import spindex
+        sindex = spindex.get_spatial_index(frm)
+    keys = sindex.keys[sindex.query_box(poly.bounds)]
+    candidates = frm.loc[frm.index.isin(keys)]
+    func = getattr(candidates['geometry'], op)
+    return frm.loc[frm.index.isin(candidates.index[func(poly).values])]
 
 
 # def aggregate_pop_tiles_to_regions(
@@ -1,6 +1,7 @@
 import numpy as np
 import math
 import os
+import pickle
 from functools import partial
 
 import pandas as pd
@@ -21,6 +22,27 @@ from window.plot import Canvas, Data
 import analysis
 
 dataDir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'products')
+resourcesDir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'resources')
+
+REGIONTITLES = {
+    'aus': 'Australia',
+    'vic': 'Victoria',
+    'mel': 'Melbourne',
+    'nsw': 'New South Wales',
+    'syd': 'Sydney',
+    'qld': 'Queensland',
+    'bri': 'Brisbane',
+    'nt': 'Northern Territory',
+    'dar': 'Darwin',
+    'act': 'Australian Capital Territory',
+    'can': 'Canberra',
+    'sa': 'South Australia',
+    'ade': 'Adelaide',
+    'wa': 'Western Australia',
+    'per': 'Perth',
+    'tas': 'Tasmania',
+    'hob': 'Hobart',
+    }
 
 MELVIC_ANNOTATIONS = [
     ('2020-04-25', 'Anzac Day', (0, -30)),
@@ -115,66 +137,198 @@ def make_mob_plots(frm, region, aggType = 'lga'):
 
     filename = '_'.join(['mob', aggType, region]) + '.png'
     filePath = os.path.join(dataDir, filename)
-    fig.savefig(filePath)
+    with utils.atomic_path(filePath) as tempPath:
+        fig.savefig(tempPath)
+    mpl.pyplot.close(fig)
+
+def load_mob_date(filePath):
+    out = pd.read_csv(filePath)
+    out['date'] = pd.to_datetime(out['date'])
+    out = out.set_index(['date', 'code'])
+    return out
 
-def get_mob_date(region, aggType = 'lga', refresh = False, get = False, override = False):
+def get_mob_date(
+        region,
+        aggType = 'lga',
+        refresh = False,
+        get = False,
+        override = False,
+        incremental = False,
+        version = None,
+        **kwargs
+        ):
+    # With incremental, only days newer than the stored product
+    # are aggregated, provided it was built by the same version
+    # (e.g. a hash of the code and boundaries behind it):
     filename = '_'.join(['mob', aggType, region]) + '.csv'
     filePath = os.path.join(dataDir, filename)
+    statsName = '_'.join(['mobStats', aggType, region]) + '.pkl'
+    statsPath = os.path.join(resourcesDir, statsName)
     if os.path.isfile(filePath) and not refresh:
-        out = pd.read_csv(filePath)
-        out['date'] = pd.to_datetime(out['date'])
-        out = out.set_index(['date', 'code'])
-        return out
+        return load_mob_date(filePath)
+    if incremental and os.path.isfile(filePath) and os.path.isfile(statsPath):
+        with open(statsPath, 'rb') as f:
+            incremental = pickle.load(f).get('version') == version
     else:
-        out = make_mob_date(region, aggType, get = get, override = override)
-        out.to_csv(filePath)
-        return out
-def make_mob_date(region, aggType = 'lga', get = False, override = False):
+        incremental = False
+    if incremental:
+        counts, bounds = update_mob_counts(
+            region, aggType, filePath, statsPath,
+            get = get, override = override, **kwargs
+            )
+    else:
+        counts, bounds = make_mob_counts(
+            region, aggType,
+            get = get, override = override, **kwargs
+            )
+    out = weight_mob_date(counts)
+    with utils.atomic_path(filePath) as tempPath:
+        out.to_csv(tempPath)
+    # Keep what later incremental runs need to re-derive the weights:
+    with utils.atomic_path(statsPath) as tempPath:
+        with open(tempPath, 'wb') as f:
+            pickle.dump(dict(n = counts['n'], bounds = bounds, version = version), f)
+    return out
 
-    mob = load.load_fb_tiles(region, 'mob', get = get, override = override)
+def make_mob_date(region, aggType = 'lga', get = False, override = False, **kwargs):
+    counts, bounds = make_mob_counts(region, aggType, get = get, override = override, **kwargs)
+    return weight_mob_date(counts)
+
+class BoundsChanged(Exception):
+    pass
+
+def update_mob_counts(region, aggType, filePath, statsPath, **kwargs):
+    # Only the last stored day (which may have been incomplete)
+    # and anything newer is recomputed from tiles:
+    pre = load_mob_date(filePath)
+    with open(statsPath, 'rb') as f:
+        stats = pickle.load(f)
+    pre['n'] = stats['n']
+    pre = pre.drop('weight', axis = 1)
+    since = pre.index.get_level_values('date').max()
+    try:
+        new, bounds = make_mob_counts(
+            region, aggType,
+            since = since, bounds = stats['bounds'],
+            **kwargs
+            )
+    except load.NoNewFiles:
+        return pre, stats['bounds']
+    except BoundsChanged:
+        # New tiles widen the footprint, which changes the region trimming
+        # for every day; only a full rebuild stays consistent.
+        print("Tile footprint changed: rebuilding from scratch.")
+        return make_mob_counts(region, aggType, **kwargs)
+    pre = pre.loc[pre.index.get_level_values('date') < since]
+    counts = pd.concat([pre, new[pre.columns]])
+    counts = counts.sort_index()
+    return counts, bounds
+
+def weight_mob_date(counts):
+    frm = counts.copy()
+    frm['weight'] = frm['n'] / frm['n'].sum()
+    return frm[['km', 'stay', 'weight', 'visit']]
+
+def make_mob_counts(
+        region,
+        aggType = 'lga',
+        get = False,
+        override = False,
+        since = None,
+        bounds = None,
+        backend = 'pandas',
+        **kwargs
+        ):
 
-    agg = aggregate.aggregate_mob_tiles_to_abs(mob, region, aggType)
-    agg = aggregate.aggregate_by_date(agg)
+    mob = load.load_fb_tiles(region, 'mob', get = get, override = override, since = since)
+
+    quadkeys = [
+        *mob.index.get_level_values('quadkey'),
+        *mob.index.get_level_values('end_key'),
+        ]
+    tileBounds = aggregate.get_tile_bounds(quadkeys)
+    if bounds is None:
+        bounds = tileBounds
+    elif not bounds.covers(tileBounds):
+        raise BoundsChanged
+
+    if backend == 'pandas':
+        agg = aggregate.aggregate_mob_tiles_to_abs(mob, region, aggType, bounds = bounds, **kwargs)
+        agg = aggregate.aggregate_by_date(agg)
+    elif backend == 'dask':
+        import parallel
+        agg = parallel.aggregate_mob_tiles_dask(mob, region, aggType, bounds = bounds, **kwargs)
+    else:
+        raise ValueError(backend)
     assert len(agg)
 
-    frm = agg.copy()
-    frm = frm.reset_index()
-    frm['n'] *= frm['weight']
-    frm['km'] *= frm['n']
-    frm.loc[frm['km'] == 0., 'stay'] = frm['n']
-
-    trav = frm.loc[frm['start'] != frm['stop']].loc[frm['km'] > 0.].copy()
-    dateN = trav.groupby('date')['n'].aggregate(sum)
-    stopCounts = trav.groupby(['date', 'stop'])['n'].aggregate(sum)
-    visit = stopCounts / dateN
-    visit.index.names = ['date', 'code']
-
-    frm = frm.rename(dict(start = 'code'), axis = 1)
-    frm['code'] = frm['code'].astype(int)
-    frm = frm.set_index(['date', 'code'])
-    frm = frm.drop('stop', axis = 1)
-    procFrm = frm
-
-    frm = procFrm.copy()
-    frm = aggregate.aggregate_identicals(
-        frm,
-        n = sum,
-        km = sum,
-        stay = sum
+    frm = derive_mob_counts(agg)
+
+    return frm, bounds
+
+def derive_mob_counts(agg):
+
+    # All per-(date, region) sums are taken in a single binning pass:
+    # n, n * km and stay counts keyed by start region,
+    # traveller counts keyed by destination region.
+    frm = agg.reset_index()
+    n = frm['n'].values * frm['weight'].values
+    km = frm['km'].values
+    start, stop = frm['start'].values, frm['stop'].values
+    stay = np.where(km == 0., n, 0.)
+    trav = np.where((start != stop) & (km > 0.), n, 0.)
+
+    dateCodes, dates = pd.factorize(frm['date'], sort = True)
+    regionCodes, regions = pd.factorize(np.concatenate([start, stop]), sort = True)
+    nDates, nRegions = len(dates), len(regions)
+    size = nDates * nRegions
+    startKeys = dateCodes * nRegions + regionCodes[: len(frm)]
+    stopKeys = dateCodes * nRegions + regionCodes[len(frm) :]
+
+    present = np.bincount(startKeys, minlength = size) > 0
+    nSums = np.bincount(startKeys, weights = n, minlength = size)
+    kmSums = np.bincount(startKeys, weights = km * n, minlength = size)
+    staySums = np.bincount(startKeys, weights = stay, minlength = size)
+    visitSums = np.bincount(stopKeys, weights = trav, minlength = size)
+    dateTravs = np.bincount(dateCodes, weights = trav, minlength = nDates)
+
+    # Derive the ratios for the cells that have departures:
+    keys = np.flatnonzero(present)
+    dateIndices, regionIndices = np.divmod(keys, nRegions)
+    nOut = nSums[keys]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        stayOut = staySums[keys] / nOut
+        kmOut = kmSums[keys] / (nOut * (1. - stayOut))
+        visitOut = visitSums[keys] / dateTravs[dateIndices]
+    visitOut = np.nan_to_num(visitOut, nan = 0.)
+
+    index = pd.MultiIndex.from_arrays(
+        [
+            pd.to_datetime(np.asarray(dates)[dateIndices]),
+            np.asarray(regions)[regionIndices].astype(int),
+            ],
+        names = ['date', 'code'],
+        )
+    return df(
+        dict(n = nOut, km = kmOut, stay = stayOut, visit = visitOut),
+        index = index,
         )
-    frm['stay'] /= frm['n']
-    frm['km'] = frm['km'] / (frm['n'] * (1. - frm['stay']))
-#     frm['weight'] = frm['n'] / frm.reset_index().groupby('date')['n'].aggregate(sum)
-    frm['weight'] = frm['n'] / frm['n'].sum()
-    frm['visit'] = visit
-    frm['visit'] = frm['visit'].fillna(0.)
-    frm = frm.drop('n', axis = 1)
-    out = frm
 
-    return out
+def make_mob_dateMap(raw, region, aggType = 'lga', light = False, shards = False):
+
+    if light:
+        return make_mob_dateMap_light(raw, region, aggType, shards)
+
+    frm = make_mob_dateMap_frame(raw, aggType)
+
+    mapName = '_'.join(['mob', aggType, region])
+    mapTitle = '{0} mobility chart'.format(REGIONTITLES[region])
+
+    make_dateMap(frm, mapName, mapTitle, size = 600, nonVisKeys = {'name', 'area'})
 
-def make_mob_dateMap(raw, region, aggType = 'lga'):
+def make_mob_dateMap_frame(raw, aggType = 'lga', size = 600):
 
+    # One row per region, one column per metric and date (as metric_millis):
     frm = raw.copy()
     frms = []
     for key in [key for key in raw.columns if not key == 'geometry']:
@@ -187,44 +341,64 @@ def make_mob_dateMap(raw, region, aggType = 'lga'):
         frms.append(subFrm)
     concatFrm = pd.concat(frms, axis = 1)
 
-    frm = concatFrm.copy()
-    indexNames = frm.index.names
-    frm = frm.reset_index()
+    # Geometry comes pre-simplified for the map size from the pyramid:
+    import pyramid
+    frm = gdf(
+        concatFrm.copy(),
+        geometry = pyramid.get_pyramid(aggType).geometries(concatFrm.index, size = size),
+        )
     aggRegions = load.load_generic(aggType)
-    frm['geometry'] = frm['code'].apply(lambda x: aggRegions.loc[x]['geometry'])
-    frm = frm.set_index(indexNames)
-    frm = gdf(frm)
     frm['name'] = aggRegions.loc[frm.index]['name']
     frm['area'] = aggRegions.loc[frm.index]['area']
+    return frm
 
-    scale = np.sqrt(np.median(frm['geometry'].area))
-    scalingCoeff = len(frm) ** 2. * 1e-5
-    frm['geometry'] = frm['geometry'].simplify(scale * scalingCoeff)
-    frm['geometry'] = frm['geometry'].buffer(scale * 0.1 * scalingCoeff)
+def make_mob_tiles(raw, region, aggType = 'lga', zooms = range(3, 11)):
+    # Vector tiles of the same data, for products too large for one map page:
+    import vectortiles
+    tilesName = '_'.join(['mob', aggType, region]) + '_tiles'
+    return vectortiles.write_tiles(
+        raw,
+        aggType,
+        os.path.join(dataDir, tilesName),
+        zooms = zooms,
+        )
+
+def make_mob_dateMap_light(raw, region, aggType = 'lga', shards = False):
+
+    aggRegions = load.load_generic(aggType)
+    codes = sorted(set(raw.index.get_level_values('code')))
+    attrs = aggRegions.loc[codes, ['name', 'area', 'geometry']]
+    attrs.index.name = 'code'
+
+    import pyramid
+    topology = pyramid.get_pyramid(aggType).topology(codes, size = 600)
 
     mapName = '_'.join(['mob', aggType, region])
-    titlesDict = {
-        'aus': 'Australia',
-        'vic': 'Victoria',
-        'mel': 'Melbourne',
-        'nsw': 'New South Wales',
-        'syd': 'Sydney',
-        'qld': 'Queensland',
-        'nt': 'Northern Territory',
-        'dar': 'Darwin',
-        'act': 'Australian Capital Territory',
-        'sa': 'South Australia',
-        'ade': 'Adelaide',
-        'wa': 'Western Australia',
-        'per': 'Perth',
-        'tas': 'Tasmania',
-        'hob': 'Hobart',
-        }
-    mapTitle = '{0} mobility chart'.format(titlesDict[region])
+    mapTitle = '{0} mobility chart'.format(REGIONTITLES[region])
+
+    make_dateMap_light(
+        raw,
+        attrs,
+        mapName,
+        mapTitle,
+        size = 600,
+        topology = topology,
+        shards = shards,
+        )
 
-    make_dateMap(frm, mapName, mapTitle, size = 600, nonVisKeys = {'name', 'area'})
+def make_dateMap(
+        frm,
+        name,
+        title,
+        size = 600,
+        nonVisKeys = {},
+        precision = 5,
+        delta = False,
+        ):
 
-def make_dateMap(frm, name, title, size = 600, nonVisKeys = {}):
+    # The geometry is written at precision decimal places
+    # (1e-5 degrees is about a metre), delta-encoded if delta
+    # and decoded in the browser once the page is ready.
 
     minx = np.min(frm.bounds['minx'])
     maxx = np.max(frm.bounds['maxx'])
@@ -246,16 +420,20 @@ def make_dateMap(frm, name, title, size = 600, nonVisKeys = {}):
     mins = {n: frm[['_'.join([n, t]) for t in ts]].min().min() for n in ns}
     maxs = {n: frm[['_'.join([n, t]) for t in ts]].max().max() for n in ns}
 
+    import geowrite
     from bokeh.models import GeoJSONDataSource
-    geoJSON = frm.reset_index().to_json()
-    source = GeoJSONDataSource(geojson = geoJSON)
-
-    from bokeh.io import output_file
-    outFilename = name + '.html'
-    outPath = os.path.join(dataDir, outFilename)
-    if os.path.isfile(outPath):
-        os.remove(outPath)
-    output_file(outPath)
+    geoJSON = geowrite.to_geojson(
+        frm.reset_index(),
+        precision = precision,
+        delta = delta,
+        interiors = False,
+        )
+    if delta:
+        source = GeoJSONDataSource(
+            geojson = '{"type":"FeatureCollection","features":[]}'
+            )
+    else:
+        source = GeoJSONDataSource(geojson = geoJSON)
 
     from bokeh.plotting import figure
     fig = figure(
@@ -361,9 +539,245 @@ def make_dateMap(frm, name, title, size = 600, nonVisKeys = {}):
     from bokeh.layouts import column, row
     layout = column(fig, row(select, slider))
 
-    from bokeh.io import show
+    outFilename = name + '.html'
+    outPath = os.path.join(dataDir, outFilename)
+
+    if delta:
+        from bokeh.document import Document
+        from bokeh.resources import CDN
+        from bokeh.io import save
+        decode = CustomJS(
+            args = dict(source = source, encoded = geoJSON),
+            code = geowrite.DELTA_JS + """
+                source.geojson = decode_geojson(encoded)
+                """,
+            )
+        doc = Document()
+        doc.add_root(layout)
+        doc.js_on_event('document_ready', decode)
+        with utils.atomic_path(outPath) as tempPath:
+            save(doc, filename = tempPath, resources = CDN, title = title)
+        return None
+
+    from bokeh.io import output_file, save
+    with utils.atomic_path(outPath) as tempPath:
+        output_file(tempPath, title = title)
+        save(layout)
+
+def make_dateMap_light(
+        frm,
+        attrs,
+        name,
+        title,
+        size = 600,
+        tolerance = None,
+        quantization = 1e5,
+        shards = False,
+        topology = None,
+        ):
+
+    # As make_dateMap, but takes the long (date, region) frame directly
+    # and ships the geometry as quantized shared arcs and the values as
+    # one float32 array per metric, decoded and indexed in the browser.
+    # attrs holds the region geometries plus any columns for the tooltip.
+    # With shards, only the latest values are embedded; the rest are
+    # written by metric and month beside the page and fetched as needed.
+    # A precomputed topology (e.g. from the pyramid) for the regions
+    # of attrs, in order, saves building one from the geometries here.
+
+    import encode
+
+    ns = [n for n in frm.columns if not n == 'geometry']
+    assert len(ns)
+    dates, codes, values = encode.pack_values(frm, ns, codes = list(attrs.index))
+    assert len(dates)
+    ts = [int(pd.Timestamp(t).value // 10 ** 6) for t in dates]
+    nRegions = len(codes)
+
+    geoms = attrs['geometry']
+    minx, miny, maxx, maxy = geoms.total_bounds
+    aspect = (maxx - minx) / (maxy - miny)
+
+    if topology is None:
+        topo = encode.make_topology(geoms, quantization, tolerance)
+    else:
+        topo = topology
+
+    mins = {n: float(np.nanmin(values[n])) for n in ns}
+    maxs = {n: float(np.nanmax(values[n])) for n in ns}
+
+    from bokeh.models import ColumnDataSource
+    nonVisKeys = [key for key in attrs.columns if not key == 'geometry']
+    indexName = attrs.index.name
+    source = ColumnDataSource(dict(
+        xs = [[] for code in codes],
+        ys = [[] for code in codes],
+        value = values[ns[0]][-nRegions:],
+        **{indexName: list(codes)},
+        **{key: list(attrs[key]) for key in nonVisKeys},
+        ))
+    if shards:
+        shardName = name + '_shards'
+        cube = np.stack([values[n] for n in ns]).reshape(len(ns), len(dates), nRegions)
+        encode.write_shards(cube, ns, dates, os.path.join(dataDir, shardName))
+        valueSource = ColumnDataSource({n: np.zeros(0, dtype = np.float32) for n in ns})
+    else:
+        shardName = ''
+        valueSource = ColumnDataSource(values)
+    arcSource = ColumnDataSource(dict(coords = topo['coords']))
+    offsetSource = ColumnDataSource(dict(offsets = topo['offsets']))
+
+    from bokeh.plotting import figure
+    fig = figure(
+        title = title,
+        plot_height = size,
+        plot_width = int(round(size * aspect)) + 50,
+        toolbar_location = 'right',
+        tools = 'pan, zoom_in, zoom_out, wheel_zoom, reset',
+        background_fill_color = "lightgrey",
+        x_range = (minx, maxx),
+        y_range = (miny, maxy),
+        )
+
+    fig.xgrid.grid_line_color = None
+    fig.ygrid.grid_line_color = None
+
+    from bokeh.palettes import Viridis256
+    from bokeh.models import LinearColorMapper, ColorBar
+    colourMapper = LinearColorMapper(
+        palette = Viridis256,
+        low = mins[ns[0]],
+        high = maxs[ns[0]],
+        )
+    colourBar = ColorBar(
+        color_mapper = colourMapper,
+        label_standoff = 8,
+        width = 30,
+        height = int(round(fig.plot_height * 0.9)),
+        border_line_color = None,
+        location = (0, 0),
+        orientation = 'vertical',
+        )
+    fig.add_layout(colourBar, 'left')
+
+    patches = fig.patches(
+        'xs',
+        'ys',
+        source = source,
+        fill_color = dict(
+            field = 'value',
+            transform = colourMapper,
+            ),
+        line_color = 'grey',
+        line_width = 0.25,
+        fill_alpha = 1,
+        )
+
+    from bokeh.models.widgets import DateSlider as Slider
+    slider = Slider(
+        title = 'Date',
+        start = ts[0],
+        end = ts[-1],
+        step = int(8.64 * 1e7), # days
+        value = ts[-1],
+        width = fig.plot_width - 70
+        )
+
+    from bokeh.models.widgets import Select
+    select = Select(
+        title = "Dataset",
+        options = ns,
+        value = ns[0],
+        width = 60
+        )
+
+    from bokeh.models import CustomJS
+    callback = CustomJS(
+        args = dict(
+            source = source,
+            valueSource = valueSource,
+            shardUrl = shardName,
+            slider = slider,
+            select = select,
+            colourMapper = colourMapper,
+            ns = ns,
+            ts = [] if shards else ts,
+            nRegions = nRegions,
+            mins = mins,
+            maxs = maxs,
+            ),
+        code = encode.STORES_JS + """
+            const store = get_store(shardUrl || 'inline', () => {
+                if (shardUrl) {
+                    return new ShardStore(shardUrl)
+                    }
+                const cube = new Float32Array(ns.length * ts.length * nRegions)
+                ns.forEach((n, v) => cube.set(valueSource.data[n], v * ts.length * nRegions))
+                return new CubeStore(cube, ns, ts, nRegions)
+                })
+            const varName = select.value, t = slider.value
+            store.at(varName, t).then(values => {
+                if (select.value != varName || slider.value != t) {
+                    return
+                    }
+                source.data['value'] = values
+                colourMapper.low = mins[varName]
+                colourMapper.high = maxs[varName]
+                source.change.emit()
+                })
+            """,
+        )
+    slider.js_on_change('value', callback)
+    select.js_on_change('value', callback)
+
+    decode = CustomJS(
+        args = dict(
+            source = source,
+            arcSource = arcSource,
+            offsetSource = offsetSource,
+            transform = topo['transform'],
+            shapes = topo['shapes'],
+            ),
+        code = encode.TOPOLOGY_JS + """
+            const topo = {
+                transform: transform,
+                shapes: shapes,
+                coords: arcSource.data['coords'],
+                offsets: offsetSource.data['offsets'],
+                }
+            const [xs, ys] = decode_shapes(topo)
+            source.data['xs'] = xs
+            source.data['ys'] = ys
+            source.change.emit()
+            """,
+        )
+
+    from bokeh.models import HoverTool
+    tooltips = [
+        ('Index', '@' + indexName),
+        ('Value', '@value')
+        ]
+    tooltips.extend([(k.capitalize(), '@' + k) for k in nonVisKeys])
+    hover = HoverTool(
+        renderers = [patches],
+        tooltips = tooltips
+        )
+    fig.add_tools(hover)
+
+    from bokeh.layouts import column, row
+    layout = column(fig, row(select, slider))
+
+    from bokeh.document import Document
+    from bokeh.resources import CDN
+    from bokeh.io import save
+    doc = Document()
+    doc.add_root(layout)
+    doc.js_on_event('document_ready', decode)
 
-    show(layout)
+    outFilename = name + '.html'
+    outPath = os.path.join(dataDir, outFilename)
+    with utils.atomic_path(outPath) as tempPath:
+        save(doc, filename = tempPath, resources = CDN, title = title)
 
 def bokeh_spacetimepop(
         frm,
@@ -375,24 +789,24 @@ def bokeh_spacetimepop(
         pw = 700,
         ph = 700,
         xZones = dict(),
+        shards = None,
         ):
 
+    # If shards is a directory (beside the page), the data are written there
+    # by variable and month and fetched by the page as needed,
+    # and a bokeh Document (which loads the initial data when ready)
+    # is returned in place of the layout.
+
     import numpy as np
 
     import pandas as pd
-    df = pd.DataFrame
     idx = pd.IndexSlice
-    import geopandas as gpd
-    gdf = gpd.GeoDataFrame
 
-    from bokeh.models import ColumnDataSource, HoverTool, Legend, LegendItem, CDSView, IndexFilter
-    from bokeh.plotting import figure, show
-    from bokeh.io import output_notebook
+    from bokeh.models import ColumnDataSource, HoverTool, CDSView, IndexFilter
+    from bokeh.plotting import figure
 
-    #     frm = frm.reset_index().pivot(index = frm.index.names[0], columns = frm.index.names[1])
     frm = frm.copy()
     frm = frm.sort_index()
-    #     geometry = geometry.copy()
 
     from bokeh.models import Div
 
@@ -415,16 +829,28 @@ def bokeh_spacetimepop(
     seriesNames = frm.index.levels[1].sort_values()
     seriesMetaName = seriesNames.name
     seriesNames = list(seriesNames)
-    dates = [str(int(round(i.to_numpy().astype(int) / 1e6))) for i in frm.index.levels[0]]
+    dateStamps = list(frm.index.levels[0])
+    dates = [str(int(round(i.to_numpy().astype(int) / 1e6))) for i in dateStamps]
     frm.index = frm.index.set_levels(dates, level = 0)
     defaultVar = varNames[0]
     defaultDate = dates[-1]
-    pivotFrm = frm.reset_index() \
-        .pivot(index = frm.index.names[0], columns = frm.index.names[1]) \
-        .sort_index()
 
-    defaultVar = varNames[0]
-    defaultDate = dates[-1]
+    # All the data the page needs, as one dense float32 cube
+    # laid out [variable][date][series], from which the callback
+    # slices the lines, the bars and the map colours:
+    nVars, nDates, nSeries = len(varNames), len(dates), len(seriesNames)
+    grid = pd.MultiIndex.from_product([dates, seriesNames], names = frm.index.names)
+    cube = frm.loc[~frm.index.duplicated(), varNames].reindex(grid)
+    cube = cube.to_numpy(dtype = np.float32).reshape(nDates, nSeries, nVars)
+    cube = np.ascontiguousarray(cube.transpose(2, 0, 1))
+    import encode
+    if shards is None:
+        cubeSource = ColumnDataSource(dict(cube = cube.ravel()))
+        shardUrl = ''
+    else:
+        encode.write_shards(cube, varNames, dateStamps, shards)
+        cubeSource = ColumnDataSource(dict(cube = np.zeros(0, dtype = np.float32)))
+        shardUrl = os.path.basename(os.path.normpath(shards))
 
     for key in varNames:
         if not key in varNotes:
@@ -437,25 +863,32 @@ def bokeh_spacetimepop(
         width = pw - 120,
         )
 
-    lineSources = {
-        key: ColumnDataSource(pivotFrm[key])
-            for key in pivotFrm.columns.levels[0]
-        }
-    lineSource = ColumnDataSource(pivotFrm[defaultVar])
-    lineSource.name = defaultVar
-
-    barSources = dict()
-    for varName in varNames:
-        for index, date in zip(sorted(pivotFrm.index), dates):
-            series = pivotFrm.loc[index, varName]
-            subFrm = df(dict(
-                name = series.index,
-                value = series.values,
-                height = abs(series.values),
-                offset = series.values / 2.
-                ))
-            barSources[varName + '_' + date] = ColumnDataSource(subFrm)
-    barSource = ColumnDataSource(barSources[defaultVar + '_' + defaultDate].data)
+    xName = frm.index.names[0]
+    defaultVarIndex, defaultDateIndex = 0, nDates - 1
+
+    if shards is None:
+        lineSource = ColumnDataSource({
+            xName: np.array([int(d) for d in dates], dtype = np.float64),
+            **{
+                seriesName: cube[defaultVarIndex, :, i]
+                    for i, seriesName in enumerate(seriesNames)
+                },
+            })
+        lineSource.name = defaultVar
+    else:
+        # Filled from the shards once the page is ready:
+        lineSource = ColumnDataSource({
+            key: np.zeros(0) for key in [xName, *seriesNames]
+            })
+        lineSource.name = ''
+
+    defaultValues = cube[defaultVarIndex, defaultDateIndex]
+    barSource = ColumnDataSource(dict(
+        name = seriesNames,
+        value = defaultValues,
+        height = np.abs(defaultValues),
+        offset = defaultValues / 2.,
+        ))
     barSource.name = ', '.join([str(defaultVar), str(defaultDate)])
 
     bounds = geometry.bounds
@@ -472,19 +905,25 @@ def bokeh_spacetimepop(
     for name in frm.index.levels[1]:
         if not name in geometry.index:
             geometry[name] = allPoly
-    geometry = geometry.simplify(np.sqrt(geometry.area).min() * 10. ** 3.5)
-    geoFrm = frm.reset_index().pivot(index = frm.index.names[1], columns = frm.index.names[0])
-    geoFrm.columns = geoFrm.columns.map('_'.join).str.strip('_')
-    geoFrm['geometry'] = geometry
-    geoFrm = gdf(geoFrm)
-    from bokeh.models import GeoJSONDataSource
-    geoJSON = geoFrm.reset_index().to_json()
-    geoSource = GeoJSONDataSource(geojson = geoJSON)
+    # Exteriors only, multipolygon parts separated by NaNs,
+    # as GeoJSONDataSource would give:
+    def to_xy(geom):
+        rings = encode.polygon_exteriors(geom)
+        if not rings:
+            return np.zeros(0), np.zeros(0)
+        nan = np.array([[np.nan, np.nan]])
+        pts = np.concatenate([part for ring in rings for part in (nan, ring)][1:])
+        return pts[:, 0], pts[:, 1]
+    xys = [to_xy(geometry[seriesName]) for seriesName in seriesNames]
+    geoSource = ColumnDataSource({
+        'xs': [xy[0] for xy in xys],
+        'ys': [xy[1] for xy in xys],
+        'value': defaultValues,
+        seriesMetaName: seriesNames,
+        })
     mins = {n: frm[n].min() for n in varNames}
     maxs = {n: frm[n].max() for n in varNames}
 
-    xName = frm.index.names[0]
-
     lineFig = figure(
         x_axis_type = 'datetime',
         y_range = (mins[defaultVar], maxs[defaultVar]),
@@ -603,13 +1042,12 @@ def bokeh_spacetimepop(
             source = geoSource,
             view = view,
             fill_color = dict(
-                field = '_'.join([defaultVar, defaultDate]),
+                field = 'value',
                 transform = mapColourMapper,
                 ),
             line_color = 'grey', 
             line_width = 0.25,
             fill_alpha = 0.,
-            name = '_'.join([defaultVar, defaultDate])
             )
         patches.append(patch)
 
@@ -618,7 +1056,7 @@ def bokeh_spacetimepop(
         renderers = patches,
         tooltips = [
             (seriesMetaName.capitalize(), f'@{seriesMetaName}'),
-            ('Value', '@$name'),
+            ('Value', '@value'),
             ]
         )
     mapFig.add_tools(mapHover)
@@ -692,10 +1130,11 @@ def bokeh_spacetimepop(
     callback = CustomJS(
         args = dict(
             y_range = lineFig.y_range,
-            lineSources = lineSources,
+            cubeSource = cubeSource,
+            shardUrl = shardUrl,
             lineSource = lineSource,
-            barSources = barSources,
             barSource = barSource,
+            geoSource = geoSource,
             bars = bars,
             lines = lines,
             patches = patches,
@@ -705,24 +1144,25 @@ def bokeh_spacetimepop(
             checkboxes = checkboxes,
             varNote = varNote,
             varNotes = varNotes,
-            geoSource = geoSource,
             mapColourMapper = mapColourMapper,
+            varNames = varNames,
+            seriesNames = seriesNames,
+            xName = xName,
+            dates = [] if shardUrl else [int(d) for d in dates],
             mins = mins,
             maxs = maxs,
             ),
-        code = """
-            lineSource.data = lineSources[select.value].data
-            lineSource.name = select.value
-            lineSource.change.emit()
-            span.location = slider.value
+        code = encode.STORES_JS + """
+            const store = get_store(shardUrl || 'inline', () => shardUrl ?
+                new ShardStore(shardUrl) :
+                new CubeStore(cubeSource.data['cube'], varNames, dates, seriesNames.length)
+                )
+            const varName = select.value, t = slider.value
+            span.location = t
             span.change.emit()
-            y_range.setv({'start': mins[select.value], 'end': maxs[select.value]})
-            varNote.text = varNotes[select.value]
+            y_range.setv({'start': mins[varName], 'end': maxs[varName]})
+            varNote.text = varNotes[varName]
             varNote.change.emit()
-            const barChoice = select.value + '_' + slider.value
-            barSource.data = barSources[barChoice].data
-            barSource.name = select.value.toString() + ', ' + slider.value.toString()
-            barSource.change.emit()
             for (let i = 0; i < lines.length; i++){
                 let checked = checkboxes.active.includes(i)
                 lines[i].muted = !(checked)
@@ -730,14 +1170,39 @@ def bokeh_spacetimepop(
                 var alpha = checked ? 1 : 0;
                 patches[i].glyph.fill_alpha = alpha
             }
-            const newCol = select.value + '_' + slider.value
-            for (let i = 0; i < lines.length; i++){
-                patches[i].glyph.fill_color['field'] = newCol
-                patches[i].name = newCol
-            }
-            mapColourMapper.low = mins[select.value]
-            mapColourMapper.high = maxs[select.value]
-            geoSource.change.emit()
+            if (lineSource.name != varName) {
+                lineSource.name = varName
+                Promise.all([store.index(), store.series(varName)]).then(([index, block]) => {
+                    if (select.value != varName) {
+                        return
+                        }
+                    const nDates = index.dates.length, nSeries = index.nSeries
+                    const data = {}
+                    data[xName] = Float64Array.from(index.dates)
+                    for (let s = 0; s < nSeries; s++) {
+                        const series = new Float32Array(nDates)
+                        for (let d = 0; d < nDates; d++) {
+                            series[d] = block[d * nSeries + s]
+                            }
+                        data[seriesNames[s]] = series
+                        }
+                    lineSource.data = data
+                    })
+                }
+            store.at(varName, t).then(values => {
+                if (select.value != varName || slider.value != t) {
+                    return
+                    }
+                barSource.data['value'] = values
+                barSource.data['height'] = values.map(Math.abs)
+                barSource.data['offset'] = values.map(x => x / 2)
+                barSource.name = varName.toString() + ', ' + t.toString()
+                barSource.change.emit()
+                geoSource.data['value'] = values
+                mapColourMapper.low = mins[varName]
+                mapColourMapper.high = maxs[varName]
+                geoSource.change.emit()
+                })
             """,
         )
 
@@ -776,28 +1241,90 @@ def bokeh_spacetimepop(
         mapFig
         )
 
-    return layout
+    if shards is None:
+        return layout
 
-def make_meldash(returnPlot = False):
+    from bokeh.document import Document
+    doc = Document()
+    doc.add_root(layout)
+    doc.js_on_event('document_ready', callback)
 
-    name = 'meldash'
-    frm = analysis.make_melvicFrm()
+    return doc
+
+# Periods shaded on each metro's dashboard:
+DASHZONES = dict(
+    mel = {
+        "First Lockdown": (None, '2020-05-13'),
+        "Queen's Birthday": ('2020-06-07', '2020-06-09'),
+        "School holidays": ('2020-06-26', '2020-07-20'),
+        "Second lockdown": ('2020-07-09', None),
+        "Stage Four": ('2020-08-02', None),
+        },
+    )
+
+def make_dash_frame(metro = 'mel'):
+
+    frm = analysis.make_dashFrm(metro)
     frm['score'] = 1. - frm['score']
     # Saving
-    frm.to_csv(os.path.join(dataDir, name + '.csv'))
-
-    geometry = analysis.make_geometry(frm.index.levels[1], region = 'vic')
-    # Fix Mornington Peninsula, which is a multipolygon:
-    multipoly = geometry['Mornington Peninsula']
-    geofrm = gpd.GeoSeries(list(multipoly))
-    geometry['Mornington Peninsula'] = geofrm[
-        sorted(zip(geofrm.index, geofrm.area), key = lambda s: s[1])[-1][0]
-        ]
+    with utils.atomic_path(os.path.join(dataDir, metro + 'dash.csv')) as tempPath:
+        frm.to_csv(tempPath)
+
+    return frm
+
+def make_meldash_frame():
+    return make_dash_frame('mel')
+
+def make_dash(metro = 'mel', frm = None, returnPlot = False, shards = False):
+
+    name = metro + 'dash'
+    if frm is None:
+        frm = make_dash_frame(metro)
+
+    # Case data (and its notes) only where there is any:
+    caseNotes = {
+        'cumulative': """
+            This is the cumulative number of new locally-sourced COVID-19 cases
+            detected in each council per 10,000 council residents.
+            Sourced from the
+            <a href="https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv">Victorian Department of Health and Human Services.</a>
+            """,
+        'new': """
+            This is the number of new locally-sourced COVID-19 cases
+            detected in each council per 10,000 council residents.
+            Sourced from the
+            <a href="https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv">Victorian Department of Health and Human Services.</a>
+            """,
+        'new_rolling': """
+            Reported cases tend to oscillate due to uneven sampling rates.
+            This 7-day rolling average of the 'new cases' metric
+            attempts to smooth out this effect to provide a better sense of the overall trend.
+            Sourced from the
+            <a href="https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv">Victorian Department of Health and Human Services.</a>
+            """,
+        'mystery': """
+            This is the number of new locally-sourced COVID-19 cases
+            detected in each council
+            for which the source of transmission is not known,
+            per 10,000 council residents.
+            Sourced from the
+            <a href="https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv">Victorian Department of Health and Human Services.</a>
+            """,
+        }
+    if not load.METROSTATES[metro] in analysis.CASESTATES:
+        frm = frm.drop(list(caseNotes), axis = 1, errors = 'ignore')
+        caseNotes = dict()
+
+    geometry = analysis.make_geometry(
+        frm.index.levels[1],
+        region = load.METROSTATES[metro],
+        size = 880,
+        )
 
     myplot = bokeh_spacetimepop(
         frm,
         geometry = geometry,
-        title = 'Mobility During COVID - Melbourne Councils',
+        title = 'Mobility During COVID - {0} Councils'.format(REGIONTITLES[metro]),
         preamble = f"""
             These plots, based on Facebook location tracking data,
             show the <b>changes in patterns of movement</b>
@@ -818,33 +1345,7 @@ def make_meldash(returnPlot = False):
             <a href="mailto:rohan.byrne@unimelb.edu.au">Rohan Byrne</a>.
             """,
         varNotes = {
-            'cumulative': """
-                This is the cumulative number of new locally-sourced COVID-19 cases
-                detected in each council per 10,000 council residents.
-                Sourced from the
-                <a href="https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv">Victorian Department of Health and Human Services.</a>
-                """,
-            'new': """
-                This is the number of new locally-sourced COVID-19 cases
-                detected in each council per 10,000 council residents.
-                Sourced from the
-                <a href="https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv">Victorian Department of Health and Human Services.</a>
-                """,
-            'new_rolling': """
-                Reported cases tend to oscillate due to uneven sampling rates.
-                This 7-day rolling average of the 'new cases' metric
-                attempts to smooth out this effect to provide a better sense of the overall trend.
-                Sourced from the
-                <a href="https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv">Victorian Department of Health and Human Services.</a>
-                """,
-            'mystery': """
-                This is the number of new locally-sourced COVID-19 cases
-                detected in each council
-                for which the source of transmission is not known,
-                per 10,000 council residents.
-                Sourced from the
-                <a href="https://www.dhhs.vic.gov.au/ncov-covid-cases-by-lga-source-csv">Victorian Department of Health and Human Services.</a>
-                """,
+            **caseNotes,
             'km': """
                 This shows the average distance travelled
                 by Facebook users in each council observed moving
@@ -874,28 +1375,30 @@ def make_meldash(returnPlot = False):
                 who travelled to destinations within a given council area.
                 """,
             },
-        xZones = {
-            "First Lockdown": (None, '2020-05-13'),
-            "Queen's Birthday": ('2020-06-07', '2020-06-09'),
-            "School holidays": ('2020-06-26', '2020-07-20'),
-            "Second lockdown": ('2020-07-09', None),
-            "Stage Four": ('2020-08-02', None),
-            },
+        xZones = DASHZONES.get(metro, dict()),
         pw = 900,
         ph = 900,
+        shards = os.path.join(dataDir, name + '_shards') if shards else None,
         )
 
-    from bokeh.io import output_file, show
+    from bokeh.io import save
+    from bokeh.resources import CDN
     outFilename = name + '.html'
     outPath = os.path.join(dataDir, outFilename)
-    if os.path.isfile(outPath):
-        os.remove(outPath)
-    output_file(outPath, title = 'Melbourne COVID dashboard')
-    show(myplot)
+    with utils.atomic_path(outPath) as tempPath:
+        save(
+            myplot,
+            filename = tempPath,
+            resources = CDN,
+            title = '{0} COVID dashboard'.format(REGIONTITLES[metro]),
+            )
 
     if returnPlot:
         return myplot
 
+def make_meldash(frm = None, returnPlot = False, shards = False):
+    return make_dash('mel', frm, returnPlot, shards)
+
 def make_melsummary_se_plot():
 
     global dataDir
@@ -0,0 +1,117 @@
+import os
+import pickle
+
+import numpy as np
+import geopandas as gpd
+
+import load
+import utils
+import encode
+
+repoPath = os.path.abspath(os.path.dirname(__file__))
+
+# Each boundary set is cut once into shared arcs, and the arcs are simplified
+# at a ladder of tolerances (in degrees, roughly 10 m to 3 km); because
+# every shared boundary is simplified once for both its neighbours,
+# each level is watertight without any buffering; each arc is simplified
+# without letting it cross itself, though arcs may still cross each other
+# at the coarsest levels.
+# As everywhere in encode, only polygon exteriors are kept: holes are lost
+# (bokeh's patches never drew them), so geometries gives filled outlines.
+# The result is cached on disk beside the other resources, keyed by
+# the boundary files and tolerances it was built from, so map builders
+# only ever pick a level and subset it.
+
+TOLERANCES = (1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2)
+
+PYRAMIDS = dict()
+
+def pyramid_key(aggType, tolerances = TOLERANCES):
+    stats = [
+        (os.path.basename(path), os.stat(path).st_size, int(os.stat(path).st_mtime))
+            for path in load.generic_paths(aggType) if os.path.isfile(path)
+        ]
+    return utils.make_hash([stats, list(tolerances)])
+
+def get_pyramid(aggType, override = False):
+    key = pyramid_key(aggType)
+    if (aggType, key) in PYRAMIDS and not override:
+        return PYRAMIDS[(aggType, key)]
+    filename = '_'.join(['pyramid', aggType, key]) + '.pkl'
+    filePath = os.path.join(repoPath, 'resources', filename)
+    if os.path.isfile(filePath) and not override:
+        with open(filePath, 'rb') as f:
+            out = pickle.load(f)
+    else:
+        out = make_pyramid(load.load_generic(aggType))
+        with utils.atomic_path(filePath) as tempPath:
+            with open(tempPath, 'wb') as f:
+                pickle.dump(out, f)
+    PYRAMIDS[(aggType, key)] = out
+    return out
+
+def make_pyramid(frm, tolerances = TOLERANCES, quantization = 1e6):
+    print("Building geometry pyramid...")
+    transform, arcs, shapes = encode.build_arcs(frm['geometry'], quantization)
+    levels = [encode.simplify_arcs(arcs, transform, tol) for tol in tolerances]
+    print("Built.")
+    return Pyramid(
+        index = frm.index,
+        bounds = np.asarray(frm.bounds.values, dtype = float),
+        crs = frm.crs,
+        transform = transform,
+        shapes = shapes,
+        tolerances = list(tolerances),
+        levels = levels,
+        )
+
+class Pyramid:
+
+    def __init__(self, index, bounds, crs, transform, shapes, tolerances, levels):
+        self.index = index
+        self.bounds = bounds
+        self.crs = crs
+        self.transform = transform
+        self.shapes = shapes
+        self.tolerances = tolerances
+        self.levels = levels
+
+    def positions(self, keys = None):
+        if keys is None:
+            return np.arange(len(self.index))
+        return self.index.get_indexer(list(keys))
+
+    def pick_level(self, keys = None, size = 600):
+        # The coarsest level whose tolerance is still under a pixel
+        # when the selected regions span size pixels:
+        bounds = self.bounds[self.positions(keys)]
+        span = max(
+            bounds[:, 2].max() - bounds[:, 0].min(),
+            bounds[:, 3].max() - bounds[:, 1].min(),
+            )
+        return self.level_for(span / size)
+
+    def level_for(self, pixel):
+        # The coarsest level whose tolerance is under pixel (in degrees):
+        fits = [i for i, tol in enumerate(self.tolerances) if tol <= pixel]
+        return fits[-1] if fits else 0
+
+    def topology(self, keys = None, level = None, size = 600):
+        # Shared-arc topology (as encode.make_topology gives)
+        # for just the selected regions, in the order given:
+        if level is None:
+            level = self.pick_level(keys, size)
+        positions = self.positions(keys)
+        if np.any(positions < 0):
+            raise KeyError("Regions not in boundary set.")
+        shapes = [self.shapes[i] for i in positions]
+        return encode.pack_topology(self.transform, self.levels[level], shapes)
+
+    def geometries(self, keys = None, level = None, size = 600):
+        topology = self.topology(keys, level, size)
+        index = self.index[self.positions(keys)]
+        return gpd.GeoSeries(
+            encode.decode_topology(topology),
+            index = index,
+            crs = self.crs,
+            )
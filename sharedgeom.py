@@ -0,0 +1,153 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import geopandas as gpd
+gdf = gpd.GeoDataFrame
+import shapely.wkb
+
+import load
+
+repoPath = os.path.abspath(os.path.dirname(__file__))
+
+# A boundary set is flattened into one contiguous block:
+#     [bounds: n x 4 float64 | offsets: n + 1 int64 | concatenated WKB]
+# which lives either in a named shared memory block or a memory-mapped file.
+# Only a small picklable handle (sizes, index, non-geometry columns)
+# needs to be passed to the processes that attach to it.
+
+def export_boundaries(frm, name = None, path = None):
+    geoms = list(frm['geometry'])
+    wkbs = [geom.wkb for geom in geoms]
+    n = len(geoms)
+    offsets = np.zeros(n + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(w) for w in wkbs])
+    bounds = np.array([geom.bounds for geom in geoms], dtype = np.float64)
+    bounds = bounds.reshape(n, 4)
+    nBytes = bounds.nbytes + offsets.nbytes + int(offsets[-1])
+    handle = dict(
+        name = name,
+        path = path,
+        n = n,
+        nBytes = nBytes,
+        attrs = frm.drop('geometry', axis = 1),
+        crs = frm.crs,
+        )
+    if path is None:
+        shm = shared_memory.SharedMemory(name = name, create = True, size = max(nBytes, 1))
+        buf = shm.buf
+    else:
+        shm = None
+        buf = np.memmap(path, dtype = np.uint8, mode = 'w+', shape = (max(nBytes, 1),))
+    arr = np.ndarray((nBytes,), dtype = np.uint8, buffer = buf)
+    arr[: bounds.nbytes] = bounds.view(np.uint8).ravel()
+    arr[bounds.nbytes : bounds.nbytes + offsets.nbytes] = offsets.view(np.uint8)
+    arr[bounds.nbytes + offsets.nbytes :] = np.frombuffer(b''.join(wkbs), dtype = np.uint8)
+    del arr
+    if shm is None:
+        buf.flush()
+        del buf
+    return SharedBoundaries(handle, _shm = shm)
+
+def export_generic(aggTypes, mmapDir = None):
+    out = dict()
+    for aggType in sorted(aggTypes):
+        frm = load.load_generic(aggType)
+        if mmapDir is None:
+            name = '_'.join(['boundaries', aggType, str(os.getpid())])
+            out[aggType] = export_boundaries(frm, name = name)
+        else:
+            if not os.path.isdir(mmapDir):
+                os.makedirs(mmapDir)
+            path = os.path.join(mmapDir, 'boundaries_' + aggType + '.bin')
+            out[aggType] = export_boundaries(frm, path = path)
+    return out
+
+def attach(handle):
+    return SharedBoundaries(handle)
+
+def visible(handle):
+    # Whether this process can see the exported block: a memory-mapped file
+    # written on another node is only there if it sits on a shared filesystem.
+    if handle['path'] is None:
+        return True
+    return os.path.isfile(handle['path']) \
+        and os.path.getsize(handle['path']) == max(handle['nBytes'], 1)
+
+class SharedBoundaries:
+
+    def __init__(self, handle, _shm = None):
+        self.handle = handle
+        self.owner = _shm is not None
+        n, nBytes = handle['n'], handle['nBytes']
+        if handle['path'] is None:
+            if _shm is None:
+                try:
+                    _shm = shared_memory.SharedMemory(name = handle['name'], track = False)
+                except TypeError:
+                    _shm = shared_memory.SharedMemory(name = handle['name'])
+            self._shm = _shm
+            buf = _shm.buf
+        else:
+            self._shm = None
+            buf = np.memmap(handle['path'], dtype = np.uint8, mode = 'r', shape = (max(nBytes, 1),))
+        self._buf = np.ndarray((nBytes,), dtype = np.uint8, buffer = buf)
+        boundsEnd = n * 32
+        offsetsEnd = boundsEnd + (n + 1) * 8
+        self.bounds = self._buf[: boundsEnd].view(np.float64).reshape(n, 4)
+        self.offsets = self._buf[boundsEnd : offsetsEnd].view(np.int64)
+        self._wkb = self._buf[offsetsEnd :]
+        self.attrs = handle['attrs']
+        self.index = self.attrs.index
+        # Geometries decoded so far in this process, shared by every
+        # frame loaded from here (so each is only decoded once per process):
+        self._geoms = np.full(n, None, dtype = object)
+
+    def __len__(self):
+        return self.handle['n']
+
+    def geometry(self, i):
+        if self._geoms[i] is None:
+            self._geoms[i] = shapely.wkb.loads(
+                self._wkb[self.offsets[i] : self.offsets[i + 1]].tobytes()
+                )
+        return self._geoms[i]
+
+    def select(self, bbox):
+        # Positions of the geometries whose bounding boxes meet bbox:
+        minx, miny, maxx, maxy = bbox
+        bounds = self.bounds
+        return np.flatnonzero(
+            (bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx)
+                & (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny)
+            )
+
+    def load_frame(self, bbox = None):
+        # Geometries are only decoded for the rows asked for, and only
+        # the first time they are asked for; the frames returned hold
+        # their own rows but share the decoded geometries, so the resident
+        # copy per process stays proportional to use rather than to jobs:
+        if bbox is None:
+            indices = np.arange(len(self))
+        else:
+            indices = self.select(bbox)
+        for i in indices[[g is None for g in self._geoms[indices]]]:
+            self.geometry(i)
+        geoms = self._geoms[indices]
+        return gdf(
+            self.attrs.iloc[indices].copy(),
+            geometry = geoms,
+            crs = self.handle['crs'],
+            )
+
+    def close(self):
+        self.bounds = self.offsets = self._wkb = self._buf = self._geoms = None
+        if self._shm is not None:
+            self._shm.close()
+
+    def unlink(self):
+        if self.handle['path'] is None:
+            if self.owner:
+                self._shm.unlink()
+        elif os.path.exists(self.handle['path']):
+            os.remove(self.handle['path'])
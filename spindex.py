@@ -0,0 +1,146 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+import utils
+
+repoPath = os.path.abspath(os.path.dirname(__file__))
+
+# R-trees over boundary sets, bulk-loaded once and kept on disk
+# beside the other cached resources; opened lazily on first query.
+# Only named indexes (e.g. one per boundary set, see get_generic_index)
+# are kept on disk; an index over any other frame, such as a trimmed
+# subset of a boundary set, is built in memory and thrown away,
+# since it would seldom be asked for again. Subsets of a boundary set
+# should rather query its generic index and keep the candidates
+# in the subset (as SpatialIndex.query_join does).
+
+INDEXES = dict()
+
+def get_spatial_index(frm, name = None, override = False):
+    if name is None:
+        return SpatialIndex(None, np.asarray(frm.index), np.asarray(frm.bounds.values, dtype = float))
+    if name in INDEXES and not override:
+        return INDEXES[name]
+    basePath = os.path.join(repoPath, 'resources', '_'.join(['sindex', name]))
+    metaPath = basePath + '.pkl'
+    if os.path.isfile(metaPath) and not override:
+        with open(metaPath, 'rb') as f:
+            keys, bounds = pickle.load(f)
+        out = SpatialIndex(basePath, keys, bounds)
+    else:
+        out = make_spatial_index(frm, basePath)
+    INDEXES[name] = out
+    return out
+def make_spatial_index(frm, basePath):
+    from rtree import index
+    keys = np.asarray(frm.index)
+    bounds = np.asarray(frm.bounds.values, dtype = float)
+    properties = index.Property()
+    properties.overwrite = True
+    # Build under a temporary name so concurrent readers never see a partial tree:
+    dirName, baseName = os.path.split(basePath)
+    tempPath = os.path.join(dirName, '.' + str(os.getpid()) + '.' + baseName)
+    stream = ((i, tuple(b), None) for i, b in enumerate(bounds))
+    tree = index.Index(tempPath, stream, properties = properties)
+    tree.close()
+    for ext in ('.dat', '.idx'):
+        os.replace(tempPath + ext, basePath + ext)
+    with utils.atomic_path(basePath + '.pkl') as tempMetaPath:
+        with open(tempMetaPath, 'wb') as f:
+            pickle.dump((keys, bounds), f)
+    return SpatialIndex(basePath, keys, bounds)
+
+def generic_name(aggType):
+    # Keyed by the boundary files too, so that new boundaries get a new name:
+    import load
+    stats = [
+        (os.path.basename(path), os.stat(path).st_size, int(os.stat(path).st_mtime))
+            for path in load.generic_paths(aggType) if os.path.isfile(path)
+        ]
+    return '_'.join([aggType, utils.make_hash(stats)])
+
+def get_generic_index(aggType):
+    import load
+    name = generic_name(aggType)
+    if name in INDEXES:
+        return INDEXES[name]
+    return get_spatial_index(load.load_generic(aggType), name = name)
+
+class SpatialIndex:
+
+    def __init__(self, basePath, keys, bounds):
+        self.basePath = basePath
+        self.keys = keys
+        self.bounds = bounds
+        self._tree = None
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            from rtree import index
+            if self.basePath is None:
+                stream = ((i, tuple(b), None) for i, b in enumerate(self.bounds))
+                self._tree = index.Index(stream)
+            else:
+                self._tree = index.Index(self.basePath)
+        return self._tree
+
+    def __getstate__(self):
+        return dict(basePath = self.basePath, keys = self.keys, bounds = self.bounds)
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def query_boxes(self, boxes):
+        # Bulk query: returns (box positions, region positions)
+        # for every bounding-box overlap.
+        boxes = np.asarray(boxes, dtype = float).reshape(-1, 4)
+        tree = self.tree
+        if hasattr(tree, 'intersection_v'):
+            ids, counts = tree.intersection_v(boxes[:, :2].copy(), boxes[:, 2:].copy())
+            counts = np.asarray(counts, dtype = np.int64)
+            boxPos = np.repeat(np.arange(len(boxes)), counts)
+            return boxPos, np.asarray(ids, dtype = np.int64)
+        hits = [list(tree.intersection(tuple(box))) for box in boxes]
+        boxPos = np.repeat(np.arange(len(boxes)), [len(h) for h in hits])
+        regionPos = np.array([i for h in hits for i in h], dtype = np.int64)
+        return boxPos, regionPos
+
+    def query_box(self, box):
+        return self.query_boxes([box])[1]
+
+    def candidates(self, keys = None):
+        # Positions of the indexed regions present in keys (e.g. a trimmed frame):
+        if keys is None:
+            return None
+        return np.isin(self.keys, np.asarray(keys))
+
+    def query_join(self, fromFrm, toFrm, predicate = 'intersects', how = 'inner'):
+        # Equivalent of sjoin(fromFrm, toFrm, how, predicate)
+        # restricted to the regions of toFrm, giving an 'index_right' column:
+        boxPos, regionPos = self.query_boxes(fromFrm.bounds.values)
+        keep = self.candidates(toFrm.index)
+        if keep is not None:
+            mask = keep[regionPos]
+            boxPos, regionPos = boxPos[mask], regionPos[mask]
+        regionKeys = self.keys[regionPos]
+        left = gpd.GeoSeries(fromFrm['geometry'].values[boxPos])
+        right = gpd.GeoSeries(toFrm['geometry'].loc[regionKeys].values)
+        mask = np.asarray(getattr(left, predicate)(right))
+        boxPos, regionKeys = boxPos[mask], regionKeys[mask]
+        joined = fromFrm.iloc[boxPos].copy()
+        joined['index_right'] = regionKeys
+        if how == 'left':
+            missed = np.setdiff1d(np.arange(len(fromFrm)), boxPos)
+            if len(missed):
+                unmatched = fromFrm.iloc[missed].copy()
+                unmatched['index_right'] = np.nan
+                joined = pd.concat([joined, unmatched])
+                order = np.argsort(np.concatenate([boxPos, missed]), kind = 'stable')
+                joined = joined.iloc[order]
+        elif not how == 'inner':
+            raise ValueError(how)
+        return joined
@@ -0,0 +1,135 @@
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import analysis
+
+# Sensitivity sweeps of the stay adjustment (analysis.adjust_stay)
+# over a grid of its settings: fbFrac, fbThresh, and tileScale,
+# a multiple of the tile area make_dataFrm assumes
+# (the square of the shortest distance travelled).
+#
+# A region's inputs are loaded once and laid out as (council x date) arrays;
+# each chunk of settings is then adjusted and scored in one broadcast pass
+# over a (setting x council x date) block, rather than rebuilding
+# the whole frame per setting. Large grids are split into chunks
+# for a process pool. At any one setting the 'stay' and 'score'
+# of each council are exactly those of make_dataFrm(region, cases = False)
+# (and the 'average' rows those of its weighted averages, to rounding).
+# The result is a tidy frame indexed by (fbFrac, fbThresh, tileScale, date, name);
+# it holds two floats per setting, council and date, so a few hundred settings
+# over a state's history run to a few hundred megabytes.
+
+PARAMS = ['fbFrac', 'fbThresh', 'tileScale']
+
+def sweep_inputs(region):
+    # The unadjusted inputs of a region as aligned (council x date) arrays,
+    # with NaN where a council has no row for a date:
+    frm = analysis.make_inputFrm(region)
+    rows, names = pd.factorize(frm['name'], sort = True)
+    cols, dates = pd.factorize(frm['date'], sort = True)
+    def matrix(key):
+        out = np.full((len(names), len(dates)), np.nan)
+        out[rows, cols] = frm[key].to_numpy(dtype = float)
+        return out
+    present = np.zeros((len(names), len(dates)), dtype = bool)
+    present[rows, cols] = True
+    return dict(
+        names = pd.Index(names, name = 'name'),
+        present = present,
+        dates = pd.DatetimeIndex(dates, name = 'date'),
+        stay = matrix('stay'),
+        km = matrix('km'),
+        pop = matrix('pop'),
+        area = matrix('area'),
+        tileArea = frm['km'].min() ** 2,
+        )
+
+def sweep_chunk(inputs, settings):
+    # Adjusted stay and scores for an (nSettings x 3) array of
+    # (fbFrac, fbThresh, tileScale), as (setting x council x date) arrays,
+    # with the population-weighted average of each appended as a last council:
+    fbFrac, fbThresh, tileScale = (settings[:, i, None, None] for i in range(3))
+    stay = analysis.adjust_stay(
+        inputs['stay'],
+        inputs['km'],
+        inputs['pop'],
+        inputs['area'],
+        tileArea = inputs['tileArea'] * tileScale,
+        fbFrac = fbFrac,
+        fbThresh = fbThresh,
+        )
+    nSettings, nNames, nDates = stay.shape
+    # Every council of every setting is scored as a series of its own:
+    score = analysis.day_score_matrix(
+        stay.reshape(-1, nDates), inputs['dates']
+        ).reshape(stay.shape)
+    def average(values):
+        # Over the councils present on each date, NaN if any value is NaN
+        # (as analysis.calculate_averages):
+        present = inputs['present']
+        sums = np.where(present, values * inputs['pop'], 0.).sum(axis = 1)
+        norms = np.where(present, inputs['pop'], 0.).sum(axis = 0)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.concatenate([values, (sums / norms)[:, None]], axis = 1)
+    return average(stay), average(score)
+
+def settings_grid(fbFrac, fbThresh, tileScale):
+    return np.array(
+        list(itertools.product(fbFrac, fbThresh, tileScale)),
+        dtype = float,
+        ).reshape(-1, 3)
+
+def sweep(
+        region,
+        fbFrac = (analysis.FBFRAC,),
+        fbThresh = (analysis.FBTHRESH,),
+        tileScale = (1.,),
+        nWorkers = None,
+        chunkSize = 16,
+        ):
+
+    # Adjusted stay and scores of a region over the grid of all
+    # combinations of the given settings, as a frame with columns
+    # 'stay' and 'score' indexed by (fbFrac, fbThresh, tileScale, date, name),
+    # nans filled as in make_dataFrm.
+
+    fbFrac, fbThresh, tileScale = list(fbFrac), list(fbThresh), list(tileScale)
+    grid = settings_grid(fbFrac, fbThresh, tileScale)
+    inputs = sweep_inputs(region)
+
+    chunks = np.array_split(grid, max(1, -(-len(grid) // chunkSize)))
+    nWorkers = min(len(chunks), nWorkers or os.cpu_count() or 1)
+    if nWorkers == 1:
+        results = [sweep_chunk(inputs, chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(nWorkers) as executor:
+            futures = [executor.submit(sweep_chunk, inputs, chunk) for chunk in chunks]
+            results = [future.result() for future in futures]
+    stay = np.concatenate([stay for stay, score in results])
+    score = np.concatenate([score for stay, score in results])
+
+    # Lay out as (setting, date, name), with 'average' sorted in among the councils:
+    names = inputs['names'].append(pd.Index(['average'], name = 'name'))
+    order = np.argsort(names.to_numpy(), kind = 'stable')
+    stay = stay[:, order].transpose(0, 2, 1)
+    score = score[:, order].transpose(0, 2, 1)
+    index = pd.MultiIndex.from_product(
+        [fbFrac, fbThresh, tileScale, inputs['dates'], names[order]],
+        names = [*PARAMS, 'date', 'name'],
+        )
+    # Keeping only the (date, name) rows make_dataFrm would have:
+    present = np.vstack([inputs['present'], np.ones((1, len(inputs['dates'])), dtype = bool)])
+    present = np.tile(present[order].T.ravel(), len(grid))
+    frm = pd.DataFrame(
+        dict(stay = stay.ravel()[present], score = score.ravel()[present]),
+        index = index[present],
+        )
+
+    # Fill nans
+    frm = frm.fillna(0.)
+
+    return frm
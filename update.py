@@ -1,40 +1,22 @@
-import produce
-import analysis
-from load import NoData
-
-regions = {'vic', 'mel', 'nsw', 'syd'}
-# aggTypes = {'lga', 'sa2', 'postcodes'}
-aggTypes = {'lga',}
-#regions, aggTypes = {}, {}
-
-for region in regions:
-    for aggType in aggTypes:
-        try:
-            mob = produce.get_mob_date(
-                region,
-                aggType,
-                get = False,
-                refresh = True,
-                override = True
-                )
-            produce.make_mob_plots(
-                mob,
-                region,
-                aggType,
-                )
-            produce.make_mob_dateMap(
-                mob,
-                region,
-                aggType,
-                )
-        except NoData:
-            print("No data currently available for:", region)
-        except:
-            print("Something went wrong with:", region, aggType)
+import os
+import sys
+import json
+import time
+import argparse
+
+import fanout
+import load
+
+repoPath = os.path.abspath(os.path.dirname(__file__))
 
-produce.make_meldash()
+# Run with e.g.:
+#     python3 update.py --regions vic mel --aggTypes lga sa2 --workers 4
+#     python3 update.py --dry-run
+# or under mpirun, in which case the ranks stand in for the worker pool.
 
-produce.update_melsummary()
+REGIONS = ['vic', 'mel', 'nsw', 'syd']
+AGGTYPES = ['lga',]
+METROS = ['mel',]
 
 # regions = {
 #     'vic', 'mel', 'nsw', 'syd', 'sa', 'ade',
@@ -44,8 +26,145 @@ produce.update_melsummary()
 #     'lga', 'sa2', 'postcodes'
 #     }
 
-# regions = {'vic', 'mel'}
-# aggTypes = {'lga',}
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Rebuild the mobility products whose inputs have changed."
+        )
+    parser.add_argument(
+        '--regions',
+        nargs = '+',
+        default = REGIONS,
+        choices = load.TILEREGIONS,
+        )
+    parser.add_argument(
+        '--aggTypes',
+        nargs = '+',
+        default = AGGTYPES,
+        choices = ['lga', 'sa2', 'postcodes'],
+        )
+    parser.add_argument(
+        '--workers',
+        type = int,
+        default = None,
+        help = "Size of the worker pool (default: one per CPU).",
+        )
+    parser.add_argument(
+        '--metros',
+        nargs = '+',
+        default = METROS,
+        choices = load.TILEMETROS,
+        help = "Capitals to build dashboards for (with their states).",
+        )
+    parser.add_argument(
+        '--no-dash',
+        action = 'store_true',
+        help = "Skip the dashboard and summary products.",
+        )
+    parser.add_argument(
+        '--force',
+        action = 'store_true',
+        help = "Rebuild every stage regardless of its inputs.",
+        )
+    parser.add_argument(
+        '--light',
+        action = 'store_true',
+        help = "Write the maps as light pages (shared-arc geometry, typed value arrays) rather than GeoJSON.",
+        )
+    parser.add_argument(
+        '--shards',
+        action = 'store_true',
+        help = "Write the dashboard (and, with --light, the map) data as lazily-fetched monthly shards.",
+        )
+    parser.add_argument(
+        '--cases-dir',
+        default = None,
+        help = "Read the case data from files here instead of downloading it.",
+        )
+    parser.add_argument(
+        '--dry-run',
+        action = 'store_true',
+        help = "Only report which stages would be rebuilt.",
+        )
+    parser.add_argument(
+        '--report',
+        default = os.path.join(repoPath, 'resources', 'update_report.json'),
+        help = "Where to write the JSON run report.",
+        )
+    return parser.parse_args(argv)
+
+def dry_run(regions, aggTypes, metros = (), light = False, shards = False):
+    import pipeline
+    for region in sorted(regions):
+        for aggType in sorted(aggTypes):
+            pipeline.make_mob_pipeline(region, aggType, light = light, shards = shards).dry_run()
+    for metro in sorted(metros):
+        pipeline.make_dash_pipeline(shards, metro).dry_run()
+
+def write_report(report, path):
+    import utils
+    dirName = os.path.dirname(path)
+    if dirName and not os.path.isdir(dirName):
+        os.makedirs(dirName)
+    with utils.atomic_path(path) as tempPath:
+        with open(tempPath, 'w') as f:
+            json.dump(report, f, indent = 2)
+
+def main(argv = None):
+
+    args = parse_args(argv)
+
+    if args.cases_dir:
+        # Through the environment, so that pool workers and MPI ranks
+        # (which import casedata afresh) read the same files:
+        import casedata
+        casedata.OFFLINE_DIR = os.environ['MOBILITY_CASES_DIR'] = os.path.abspath(args.cases_dir)
+
+    if args.dry_run:
+        if fanout.is_root():
+            dry_run(
+                args.regions,
+                args.aggTypes,
+                () if args.no_dash else args.metros,
+                args.light,
+                args.shards,
+                )
+        return None
+
+    t0 = time.time()
+    products = fanout.run(
+        args.regions,
+        args.aggTypes,
+        args.workers,
+        args.force,
+        options = dict(light = args.light, shards = args.shards),
+        )
+
+    if not fanout.is_root():
+        return None
+
+    report = dict(
+        started = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(t0)),
+        args = vars(args),
+        products = products,
+        )
+    if not args.no_dash:
+        report['dashes'] = fanout.run_dashes(
+            args.metros,
+            args.workers,
+            args.force,
+            args.shards,
+            )
+    report['seconds'] = time.time() - t0
+
+    write_report(report, args.report)
+    print("Report written to:", args.report)
+
+    return report
 
-# # absLookup = produce.get_abs_lookup(aggTypes, refresh = True)
-# absLookup = produce.get_abs_lookup({'lga', 'sa2'}, refresh = True)
+if __name__ == '__main__':
+    report = main()
+    failed = report is not None and (
+        any(not p['status'] in {'done', 'unchanged', 'nodata'} for p in report['products'])
+            or any(not d['status'] == 'done' for d in report.get('dashes', ()))
+        )
+    sys.exit(1 if failed else 0)
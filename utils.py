@@ -1,6 +1,7 @@
 import os
 import numpy as np
 import hashlib
+from contextlib import contextmanager
 from datetime import datetime, timezone
 import pandas as pd
 df = pd.DataFrame
@@ -51,6 +52,19 @@ def pivot(frm, index = 'start', columns = 'date', data = 'stay'):
     frm = frm.pivot(index = index, columns = columns)
     return frm
 
+@contextmanager
+def atomic_path(filePath):
+    # Yields a temporary path beside filePath which replaces it on success,
+    # so readers never see a half-written product:
+    dirName, baseName = os.path.split(os.path.abspath(filePath))
+    tempPath = os.path.join(dirName, '.' + str(os.getpid()) + '.' + baseName)
+    try:
+        yield tempPath
+        os.replace(tempPath, filePath)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+
 def make_hash(obj):
     s = str(obj).encode()
     return str(int(hashlib.sha256(s).hexdigest(), 16) % (10 ** 8))
@@ -100,6 +114,27 @@ def get_quadkeys(totalBounds, zoom):
     allTiles = mercantile.tiles(*totalBounds, zoom)
     for tile in allTiles:
         yield mercantile.quadkey(tile)
+def lonlats_to_tiles(lons, lats, zoom):
+    lons = np.asarray(lons, dtype = float)
+    lats = np.asarray(lats, dtype = float)
+    n = 2 ** zoom
+    sinlats = np.sin(np.radians(lats))
+    xs = np.floor((lons + 180.) / 360. * n)
+    ys = np.floor(
+        (0.5 - np.log((1. + sinlats) / (1. - sinlats)) / (4. * np.pi)) * n
+        )
+    xs = np.clip(xs, 0, n - 1).astype(np.int64)
+    ys = np.clip(ys, 0, n - 1).astype(np.int64)
+    return xs, ys
+def tiles_to_quadkeys(xs, ys, zoom):
+    xs = np.asarray(xs, dtype = np.int64)
+    ys = np.asarray(ys, dtype = np.int64)
+    digits = np.zeros((len(xs), zoom), dtype = np.uint8)
+    for i in range(zoom):
+        mask = 1 << (zoom - 1 - i)
+        digits[:, i] = ((xs & mask) > 0) + 2 * ((ys & mask) > 0)
+    digits += ord('0')
+    return [k.decode() for k in digits.view('S' + str(zoom)).flatten()]
 def flip_quadkey(q, flip):
     lng, lat = quadkey_to_centroid(q)
     z = len(q)
@@ -0,0 +1,168 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+import load
+import utils
+
+# Region metrics as Mapbox Vector Tiles, for products too large
+# to ship to the browser as one GeoJSON blob (national, SA2, postcodes).
+#
+# Each zoom takes its geometry from the level of the geometry pyramid
+# that is just under a (256 px) tile pixel there, projected to web mercator
+# and clipped to each tile with a small buffer. Every feature carries
+# its code, its name and one attribute per metric and date,
+# keyed '<metric>_<millis>' as in make_dateMap.
+# Tiles are written uncompressed as <z>/<x>/<y>.pbf under a directory
+# with a TileJSON tiles.json, so any static file server can serve them
+# (see serve below); tiles whose bytes are unchanged are left untouched.
+
+EXTENT = 4096
+BUFFER = 64
+
+def tile_attributes(frm, names):
+    # One dict of attributes per region of the long (date, code) frame,
+    # leaving out missing values:
+    ns = [n for n in frm.columns if not n == 'geometry']
+    dates = sorted(set(frm.index.get_level_values('date')))
+    ts = [str(int(pd.Timestamp(t).value // 10 ** 6)) for t in dates]
+    out = dict()
+    for code, subFrm in frm[ns].groupby(level = 'code'):
+        subFrm = subFrm.droplevel('code').reindex(dates)
+        attrs = dict(code = int(code), name = str(names.get(code, '')))
+        for n in ns:
+            for t, value in zip(ts, subFrm[n].to_numpy()):
+                if np.isfinite(value):
+                    attrs['_'.join([n, t])] = float(value)
+        out[code] = attrs
+    return out, ns, ts
+
+def region_tiles(bounds, zoom):
+    import mercantile
+    minx, miny, maxx, maxy = bounds
+    return mercantile.tiles(
+        max(minx, -180.), max(miny, -85.0511),
+        min(maxx, 180.), min(maxy, 85.0511),
+        zooms = zoom,
+        )
+
+def encode_tile(tile, features, layer):
+    import mercantile
+    import mapbox_vector_tile
+    from shapely.ops import clip_by_rect
+    bounds = mercantile.xy_bounds(tile)
+    margin = (bounds.right - bounds.left) * BUFFER / EXTENT
+    clipped = []
+    for geom, attrs in features:
+        geom = clip_by_rect(
+            geom,
+            bounds.left - margin,
+            bounds.bottom - margin,
+            bounds.right + margin,
+            bounds.top + margin,
+            )
+        if not geom.is_empty:
+            clipped.append(dict(geometry = geom, properties = attrs))
+    if not clipped:
+        return None
+    return mapbox_vector_tile.encode(
+        [dict(name = layer, features = clipped)],
+        default_options = dict(
+            quantize_bounds = (bounds.left, bounds.bottom, bounds.right, bounds.top),
+            extents = EXTENT,
+            ),
+        )
+
+def write_tiles(frm, aggType, outDir, zooms = range(3, 11), layer = 'regions'):
+
+    import pyramid
+
+    aggRegions = load.load_generic(aggType)
+    attrs, ns, ts = tile_attributes(frm, aggRegions['name'].to_dict())
+    codes = sorted(attrs)
+    pyr = pyramid.get_pyramid(aggType)
+    bounds = pyr.bounds[pyr.positions(codes)]
+
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    written = set()
+    for zoom in zooms:
+        print("Writing tiles for zoom", zoom)
+        level = pyr.level_for(360. / (256 * 2 ** zoom))
+        geoms = pyr.geometries(codes, level).to_crs(epsg = 3857)
+        tiles = dict()
+        for code, geom, regionBounds in zip(codes, geoms, bounds):
+            if geom is None:
+                continue
+            for tile in region_tiles(regionBounds, zoom):
+                tiles.setdefault(tile, []).append((geom, attrs[code]))
+        for tile, features in tiles.items():
+            data = encode_tile(tile, features, layer)
+            if data is None:
+                continue
+            relPath = os.path.join(str(tile.z), str(tile.x), str(tile.y) + '.pbf')
+            written.add(relPath)
+            path = os.path.join(outDir, relPath)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    if f.read() == data:
+                        continue
+            elif not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with utils.atomic_path(path) as tempPath:
+                with open(tempPath, 'wb') as f:
+                    f.write(data)
+
+    for dirPath, dirNames, filenames in os.walk(outDir):
+        for filename in filenames:
+            path = os.path.join(dirPath, filename)
+            relPath = os.path.relpath(path, outDir)
+            if filename.endswith('.pbf') and not relPath in written:
+                os.remove(path)
+
+    minx, miny = bounds[:, :2].min(axis = 0)
+    maxx, maxy = bounds[:, 2:].max(axis = 0)
+    fields = dict(code = 'Number', name = 'String')
+    fields.update({'_'.join([n, t]): 'Number' for n in ns for t in ts})
+    index = dict(
+        tilejson = '3.0.0',
+        name = os.path.basename(os.path.normpath(outDir)),
+        tiles = ['{z}/{x}/{y}.pbf'],
+        minzoom = min(zooms),
+        maxzoom = max(zooms),
+        bounds = [float(minx), float(miny), float(maxx), float(maxy)],
+        center = [float(minx + maxx) / 2, float(miny + maxy) / 2, min(zooms)],
+        vector_layers = [dict(id = layer, fields = fields)],
+        metrics = ns,
+        dates = [int(t) for t in ts],
+        )
+    with utils.atomic_path(os.path.join(outDir, 'tiles.json')) as tempPath:
+        with open(tempPath, 'w') as f:
+            json.dump(index, f)
+    return index
+
+def serve(directory, port = 8000):
+    # Serves a tile directory (or the products directory above several)
+    # for local viewing, e.g. with maplibre pointed at
+    # http://localhost:8000/<tiles>/tiles.json
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+    class Handler(SimpleHTTPRequestHandler):
+        extensions_map = {
+            **SimpleHTTPRequestHandler.extensions_map,
+            '.pbf': 'application/x-protobuf',
+            '.json': 'application/json',
+            }
+        def end_headers(self):
+            self.send_header('Access-Control-Allow-Origin', '*')
+            super().end_headers()
+    server = ThreadingHTTPServer(('', port), partial(Handler, directory = directory))
+    print("Serving", directory, "on port", port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()